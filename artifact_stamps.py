@@ -0,0 +1,61 @@
+"""
+Content-hash stamps on the files these scripts generate.
+
+Every generated artifact (members sheet, retro doc) carries, in its Drive
+appProperties, a hash of the inputs it was made from: the members, the
+template and its revision, and the substitutions made in it.
+drive_folder_index lists appProperties with every folder listing, so the one
+files.list of a group folder is enough to tell which artifacts are stale,
+without reading any of them through the Sheets or Docs APIs.
+
+Files made before stamping was added have no stamp; get_stamp() returns None
+for them and callers fall back to checking the contents.
+"""
+
+import hashlib
+import json
+
+import drive_folder_index
+
+# appProperties key holding the hash of an artifact's inputs
+STAMP_KEY = "inputsHash"
+
+
+def content_hash(inputs):
+    """Hash any JSON serializable `inputs`, independent of dict key order."""
+    encoded = json.dumps(inputs, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+
+def stamp(inputs_hash):
+    """The appProperties to set on an artifact made from inputs hashing to `inputs_hash`."""
+    return {STAMP_KEY: inputs_hash}
+
+
+def get_stamp(file):
+    return (file.get("appProperties") or {}).get(STAMP_KEY)
+
+
+def is_fresh(file, inputs_hash):
+    return get_stamp(file) == inputs_hash
+
+
+def template_revision(template):
+    """Something that changes whenever `template` is edited."""
+    return template.get("md5Checksum") or template.get("modifiedTime")
+
+
+def find_stale_artifacts(service, folder_id, expected_hashes):
+    """
+    Compare the artifacts in `folder_id` with `expected_hashes` ({name: hash}),
+    using only the folder listing.  Returns {name: file} for every artifact that
+    exists but is stale, and {name: None} for every one that is missing.
+    """
+    stale = {}
+    for name, inputs_hash in expected_hashes.items():
+        files = drive_folder_index.find_children(service, folder_id, name)
+        if not files:
+            stale[name] = None
+        elif not any(is_fresh(file, inputs_hash) for file in files):
+            stale[name] = files[0]
+    return stale
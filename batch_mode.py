@@ -0,0 +1,88 @@
+"""
+Batch mode: work out every change first, approve once, then make them all.
+
+Instead of pausing for Return before each change, a script adds every change
+it intends to make to a plan, then calls approve(): that prints a summary by
+category, checks the optional per-category limits (e.g. no more than 10 new
+spaces), and asks a single yes/no question, or none at all when the script
+was run with --yes.  run() then makes the approved changes that carry an
+action, without further prompts.
+"""
+
+import sys
+
+# Run with --yes to approve every plan without being asked
+ASSUME_YES = "--yes" in sys.argv[1:]
+
+
+def new_plan(name):
+    return {"name": name, "items": []}
+
+
+def add(plan, category, description, action=None):
+    """Add one change to `plan`; `action` (if any) is called by run()."""
+    plan["items"].append(
+        {"category": category, "description": description, "action": action}
+    )
+
+
+def counts(plan):
+    result = {}
+    for item in plan["items"]:
+        result[item["category"]] = result.get(item["category"], 0) + 1
+    return result
+
+
+def print_summary(plan):
+    print("*" * 40)
+    print(f"{plan['name']}: {len(plan['items'])} changes planned.")
+    for category, count in counts(plan).items():
+        print(f"  {category}: {count}")
+        for item in plan["items"]:
+            if item["category"] == category:
+                print(f"    {item['description']}")
+    print("*" * 40)
+
+
+def approve(plan, limits=None, assume_yes=None):
+    """
+    Print the plan and ask once whether to go ahead.  Raises an exception if
+    any category has more changes than its entry in `limits` allows.
+    Returns True if the plan is approved (or empty).
+    """
+    print_summary(plan)
+    plan_counts = counts(plan)
+    for category, limit in (limits or {}).items():
+        if plan_counts.get(category, 0) > limit:
+            raise Exception(
+                f"{plan['name']}: {plan_counts[category]} '{category}' changes planned, "
+                f"more than the limit of {limit}.  Nothing was changed."
+            )
+    if not plan["items"]:
+        print("Nothing to do.")
+        return True
+    if ASSUME_YES if assume_yes is None else assume_yes:
+        print("Approved by --yes.")
+        return True
+    answer = input(f"Make these {len(plan['items'])} changes? [y/N] ")
+    return answer.strip().lower() in ["y", "yes"]
+
+
+def run(plan):
+    """
+    Make every change in an approved plan that has an action, carrying on
+    past failures.  Returns {description: None if it succeeded, else the exception}.
+    """
+    outcomes = {}
+    for item in plan["items"]:
+        if item["action"] is None:
+            continue
+        try:
+            item["action"]()
+            outcomes[item["description"]] = None
+        except Exception as e:
+            print(f"⚠️ {item['description']} failed: {e}")
+            outcomes[item["description"]] = e
+    failed = [description for description, e in outcomes.items() if e is not None]
+    print(f"{plan['name']}: {len(outcomes) - len(failed)} of {len(outcomes)} changes made.")
+    return outcomes
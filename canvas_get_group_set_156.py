@@ -46,7 +46,10 @@ def make_students_dict(groups):
             else:
                 # If the group does not have a leader, set leader to None
                 leader_id = None
-            users = canvas_roster_functions.get_group_members(group_id)
+            # get_groups already loaded the members
+            users = group.get('members')
+            if users is None:
+                users = canvas_roster_functions.get_group_members(group_id)
             for user in users:
                 # print("user data: ",end="")
                 # pprint(user) # for debugging/exploration of data
@@ -4,7 +4,6 @@ import make_group_notebook_folders
 from pprint import pprint
 
 from googleapiclient.discovery import build
-from googleapiclient.errors import HttpError
 import re
 import inspect
 
@@ -38,22 +37,13 @@ def add_readers_from_url(drive_service, file_url, email_list):
 
     file_id = match.group(1)
 
-    users_added = []
+    results, errors = make_group_notebook_folders.share_folder_with_members(
+        drive_service, file_id, email_list
+    )
+    users_added = [email for email in email_list if email in results]
     for email in email_list:
-        try:
-            permission = {
-                'type': 'user',
-                'role': 'writer',
-                'emailAddress': email
-            }
-            drive_service.permissions().create(
-                fileId=file_id,
-                body=permission,
-                sendNotificationEmail=False  # Set to True if you want to notify
-            ).execute()
-            users_added.append(email)
-        except HttpError as error:
-            print(f"An error occurred: {error}")
+        if email in errors:
+            print(f"An error occurred: {errors[email]}")
     print(f"Added users: {', '.join(users_added)}")
 
 def summarize_submissions_by_url(submissions, user_id_to_student):
@@ -7,6 +7,9 @@ import inspect
 import time
 import pytz
 
+import batch_mode
+import rate_limits
+
 # === CONFIGURATION ===
 API_URL = "https://ucsb.instructure.com/api/v1"
 
@@ -23,6 +26,39 @@ COURSE_ID = "25658"  # You can get this from the URL in Canvas
 
 HEADERS = {"Authorization": f"Bearer {ACCESS_TOKEN}"}
 
+# Every Canvas call in this module goes through one requests.Session, so
+# connections to Canvas are kept alive and reused instead of paying a new
+# TCP and TLS handshake per call
+CANVAS_POOL_SIZE = 10
+DEFAULT_PER_PAGE = 100
+
+
+def make_canvas_session():
+    session = requests.Session()
+    session.headers.update(HEADERS)
+    session.headers["Accept-Encoding"] = "gzip, deflate"
+    adapter = requests.adapters.HTTPAdapter(
+        pool_connections=CANVAS_POOL_SIZE, pool_maxsize=CANVAS_POOL_SIZE
+    )
+    session.mount("https://", adapter)
+    return session
+
+
+SESSION = make_canvas_session()
+
+
+def canvas_request(method, url, **kwargs):
+    """
+    Send a request to Canvas through the shared SESSION, under the Canvas
+    rate limit (see rate_limits).  GET requests ask for DEFAULT_PER_PAGE
+    results per page unless the URL (e.g. a next page link) already says.
+    """
+    if method == "GET" and "per_page=" not in url:
+        params = dict(kwargs.get("params") or {})
+        params.setdefault("per_page", DEFAULT_PER_PAGE)
+        kwargs["params"] = params
+    return rate_limits.send(SESSION, method, url, "canvas", **kwargs)
+
 
 def function_name():
     return inspect.stack()[1].function
@@ -31,11 +67,16 @@ def press_return_to_continue():
     input("Press Return to continue...")
 
 def get_groups(category_id, COURSE_ID=COURSE_ID):
+    # Ask for each group's members along with the groups themselves,
+    # 100 groups per page, instead of fetching every group's members separately
     url = f"{API_URL}/group_categories/{category_id}/groups"
+    params = {"include[]": "users", "per_page": DEFAULT_PER_PAGE}
     all_groups = []
     while url:
-        response = requests.get(url, headers=HEADERS)
+        response = canvas_request("GET", url, params=params)
         response.raise_for_status()
+        # The next page URL already carries the query parameters
+        params = None
         data = response.json()
         all_groups.extend(data)
         # Check for pagination
@@ -48,7 +89,9 @@ def get_groups(category_id, COURSE_ID=COURSE_ID):
         else:
           leader_id = None
         group["leader_id"] = leader_id
-        members = get_group_members(group["id"])
+        members = group.get("users")
+        if not members_are_complete(group, members):
+            members = get_group_members(group["id"])
         for member in members:
             loginId = member.get("login_id")
             email = f"{loginId}@ucsb.edu"
@@ -57,6 +100,16 @@ def get_groups(category_id, COURSE_ID=COURSE_ID):
     return all_groups
 
 
+def members_are_complete(group, members):
+    # Canvas can leave out users (or their login_id) from include[]=users;
+    # those groups' members are fetched the old way
+    if members is None:
+        return False
+    if group.get("members_count") is not None and len(members) != group["members_count"]:
+        return False
+    return all(member.get("login_id") for member in members)
+
+
 def add_roster_fields_to_group_members(group, roster):
     leader_id = group.get("leader_id")
     if leader_id:
@@ -123,7 +176,7 @@ def rename_group(group, new_name):
     data = {
         "name": new_name
     }
-    response = requests.put(url, headers=HEADERS, json=data)
+    response = canvas_request("PUT", url, json=data)
     response.raise_for_status()
     group["name"] = new_name
     return group
@@ -132,7 +185,7 @@ def get_group_members(group_id):
     url = f"{API_URL}/groups/{group_id}/users"
     all_members = []
     while url:
-        response = requests.get(url, headers=HEADERS)
+        response = canvas_request("GET", url)
         response.raise_for_status()
         data = response.json()
         all_members.extend(data)
@@ -146,7 +199,7 @@ def get_students(COURSE_ID=COURSE_ID):
     url = f"{API_URL}/courses/{COURSE_ID}/users?enrollment_type[]=student"
     all_students = []
     while url:
-        response = requests.get(url, headers=HEADERS)
+        response = canvas_request("GET", url)
         response.raise_for_status()
         data = response.json()
         all_students.extend(data)
@@ -183,7 +236,7 @@ def get_sections(COURSE_ID=COURSE_ID):
     url = f"{API_URL}/courses/{COURSE_ID}/sections"
     all_sections = []
     while url:
-        response = requests.get(url, headers=HEADERS)
+        response = canvas_request("GET", url)
         response.raise_for_status()
         data = response.json()
         all_sections.extend(data)
@@ -221,7 +274,7 @@ def get_section_members(section_id):
     url = f"{API_URL}/sections/{section_id}/enrollments"
     all_members = []
     while url:
-        response = requests.get(url, headers=HEADERS)
+        response = canvas_request("GET", url)
         response.raise_for_status()
         data = response.json()
         all_members.extend(data)
@@ -385,7 +438,7 @@ def make_roster_csv(COURSE_ID=COURSE_ID):
 
 def locate_assignment_by_id(assignment_id):
     url = f"{API_URL}/courses/{COURSE_ID}/assignments/{assignment_id}"
-    response = requests.get(url, headers=HEADERS)
+    response = canvas_request("GET", url)
     response.raise_for_status()
     return response.json()
 
@@ -394,7 +447,7 @@ def locate_assignment(assignment_name, COURSE_ID=COURSE_ID):
     url = f"{API_URL}/courses/{COURSE_ID}/assignments"
     assignments = []
     while url:
-        response = requests.get(url, headers=HEADERS)
+        response = canvas_request("GET", url)
         response.raise_for_status()
         data = response.json()
         assignments.extend(data)
@@ -409,7 +462,7 @@ def get_assignment_submissions(assignment_id, COURSE_ID=COURSE_ID):
     url = f"{API_URL}/courses/{COURSE_ID}/assignments/{assignment_id}/submissions"
     all_submissions = []
     while url:
-        response = requests.get(url, headers=HEADERS)
+        response = canvas_request("GET", url)
         response.raise_for_status()
         data = response.json()
         all_submissions.extend(data)
@@ -419,7 +472,7 @@ def get_assignment_submissions(assignment_id, COURSE_ID=COURSE_ID):
 
 def get_assignment_submissions_for_student(assignment_id, student_id):
     url = f"{API_URL}/courses/{COURSE_ID}/assignments/{assignment_id}/submissions/{student_id}"
-    response = requests.get(url, headers=HEADERS)
+    response = canvas_request("GET", url)
     response.raise_for_status()
     return response.json()
 
@@ -430,17 +483,12 @@ def add_feedback_to_submission(assignment_id, student_id, comment):
             "text_comment": comment
         }
     }
-    response = requests.put(url, headers=HEADERS, json=data)
+    # Each PUT appends another comment, so never send it twice
+    response = canvas_request("PUT", url, json=data, idempotent=False)
     response.raise_for_status()
     return response.json()
 
-def add_feedback_to_submission_unless_duplicate(assignment_id, student_id, comment):
-    assignment = locate_assignment_by_id(assignment_id)
-    if not assignment:
-        print(f"Assignment with id '{assignment_id}' not found.")
-        return
-
-    assignment_id = assignment["id"]
+def comment_already_exists(assignment_id, student_id, comment):
     comments = get_submission_comments_graphql(COURSE_ID, student_id, assignment_id)
     # Check if the comment already exists
         
@@ -449,7 +497,7 @@ def add_feedback_to_submission_unless_duplicate(assignment_id, student_id, comme
     
         if existing_html.strip() == comment.strip():
             print(f"Comment already exists for student {student_id}.")
-            return
+            return True
  
  
     if comments == []:
@@ -466,22 +514,52 @@ def add_feedback_to_submission_unless_duplicate(assignment_id, student_id, comme
                 print("***************")
                 print(existing_comment)
                 print("***************")
-            press_return_to_continue()
- 
-    print(f"{function_name()} called with assignment_id: {assignment_id}, student_id: {student_id}:")
-    print("***ABOUT TO ADD NEW COMMENT:***")
-    print("****** Comment *****")
-    print(comment)
-    print("********************")
-    
-    print("***Existing comments:*****")
-    pprint(comments)
-    print("***********************")
-    press_return_to_continue()
+                if equal_to_existing:
+                    return True
+    return False
+
+
+def add_feedback_to_submission_unless_duplicate(assignment_id, student_id, comment):
+    add_feedback_to_submissions_unless_duplicate(assignment_id, {student_id: comment})
+
+
+def add_feedback_to_submissions_unless_duplicate(
+    assignment_id, comments_by_student_id, limits=None, assume_yes=None
+):
+    """
+    Add each comment in `comments_by_student_id` ({student_id: comment}) to
+    that student's submission, unless it is already there.  Every new comment
+    is listed first and approved once (see batch_mode; --yes skips the
+    question), instead of pausing before each one.
+    """
+    assignment = locate_assignment_by_id(assignment_id)
+    if not assignment:
+        print(f"Assignment with id '{assignment_id}' not found.")
+        return
 
-    print(f"Adding comment to submission for student {student_id}...")
-    # Add the new comment
-    add_feedback_to_submission(assignment_id, student_id, comment)
+    assignment_id = assignment["id"]
+    plan = batch_mode.new_plan(f"Comments on {assignment['name']}")
+    for student_id, comment in comments_by_student_id.items():
+        if comment_already_exists(assignment_id, student_id, comment):
+            continue
+        print(f"{function_name()} called with assignment_id: {assignment_id}, student_id: {student_id}:")
+        print("***ABOUT TO ADD NEW COMMENT:***")
+        print("****** Comment *****")
+        print(comment)
+        print("********************")
+        batch_mode.add(
+            plan,
+            "add comment",
+            f"comment for student {student_id}",
+            lambda student_id=student_id, comment=comment: add_feedback_to_submission(
+                assignment_id, student_id, comment
+            ),
+        )
+
+    if not batch_mode.approve(plan, limits, assume_yes):
+        print("Cancelled; no comments were added.")
+        return
+    return batch_mode.run(plan)
 
 
 def get_submission_comments(COURSE_ID, assignment_id, student_id):
@@ -489,7 +567,7 @@ def get_submission_comments(COURSE_ID, assignment_id, student_id):
     params = {
         "include[]": "submission_comments"
     }
-    response = requests.get(url, headers=HEADERS, params=params)
+    response = canvas_request("GET", url, params=params)
     response.raise_for_status()
     submission = response.json()
     pprint(submission)
@@ -506,7 +584,7 @@ def get_submission_comments(course_id, user_id, assignment_id):
     params = {
         "include[]": "submission_comments"
     }
-    response = requests.get(url, headers=HEADERS, params=params)
+    response = canvas_request("GET", url, params=params)
     response.raise_for_status()
     submission = response.json()
     
@@ -573,7 +651,9 @@ def get_submission_comments_graphql(course_id, user_id, asssignment_id):
         "variables": variables
     }
 
-    response = requests.post(url, headers=headers, json=payload)
+    response = canvas_request(
+        "POST", url, headers=headers, json=payload, idempotent=True
+    )
     response.raise_for_status()
     data = response.json()
     
@@ -650,7 +730,7 @@ def get_user_details(user_id, COURSE_ID=COURSE_ID):
 
     print(f"Getting user details for user ID: {user_id}")
     url = f"{API_URL}/users/{user_id}"
-    response = requests.get(url, headers=HEADERS)
+    response = canvas_request("GET", url)
     response.raise_for_status()
     result = response.json()
     if "errors" in result:
@@ -0,0 +1,127 @@
+"""
+Local store of Google Chat messages, kept up to date incrementally.
+
+sync_space() pages through every message in a space (following
+nextPageToken) the first time, and afterwards asks only for messages with
+createTime after the newest one already stored (the space's watermark).
+Messages are kept in a SQLite file, so reading a space's history, e.g. to
+summarize who said what, needs no Chat API calls at all.
+"""
+
+import json
+import sqlite3
+import threading
+
+import rate_limits
+
+STORE_FILE = "chat_messages.sqlite"
+PAGE_SIZE = 1000  # the most messages.list returns per page
+
+_connection = None
+_lock = threading.RLock()
+
+
+def open_store(path=STORE_FILE):
+    """Open (creating if needed) the store at `path`."""
+    global _connection
+    with _lock:
+        if _connection is not None:
+            return
+        _connection = sqlite3.connect(path, check_same_thread=False)
+        _connection.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS messages (
+                name TEXT PRIMARY KEY,
+                space_name TEXT,
+                create_time TEXT,
+                message TEXT
+            );
+            CREATE INDEX IF NOT EXISTS messages_by_space
+                ON messages (space_name, create_time);
+            CREATE TABLE IF NOT EXISTS watermarks (
+                space_name TEXT PRIMARY KEY,
+                create_time TEXT
+            );
+            """
+        )
+        _connection.commit()
+
+
+def close_store():
+    global _connection
+    with _lock:
+        if _connection is not None:
+            _connection.close()
+            _connection = None
+
+
+def get_watermark(space_name):
+    """createTime of the newest stored message in `space_name`, or None."""
+    open_store()
+    with _lock:
+        row = _connection.execute(
+            "SELECT create_time FROM watermarks WHERE space_name = ?", (space_name,)
+        ).fetchone()
+        return row[0] if row else None
+
+
+def sync_space(session, space_name):
+    """
+    Fetch the messages posted to `space_name` since the last sync (or all of
+    them, the first time) into the store.  Returns the number of new messages,
+    or None if listing failed.
+    """
+    open_store()
+    watermark = get_watermark(space_name)
+    messages_url = f"https://chat.googleapis.com/v1/{space_name}/messages"
+    params = {"pageSize": PAGE_SIZE, "orderBy": "createTime asc"}
+    if watermark:
+        params["filter"] = f'createTime > "{watermark}"'
+
+    added = 0
+    while True:
+        resp = rate_limits.send(session, "GET", messages_url, "chat", params=params)
+        if resp.status_code != 200:
+            print(f"⚠️ Failed to get messages for {space_name}: {resp.text}")
+            return None
+        data = resp.json()
+        messages = data.get("messages", [])
+        with _lock:
+            for message in messages:
+                _connection.execute(
+                    "INSERT OR REPLACE INTO messages VALUES (?, ?, ?, ?)",
+                    (
+                        message["name"],
+                        space_name,
+                        message.get("createTime"),
+                        json.dumps(message),
+                    ),
+                )
+            if messages:
+                # Messages come oldest first, so the last one is the newest
+                _connection.execute(
+                    "INSERT OR REPLACE INTO watermarks VALUES (?, ?)",
+                    (space_name, messages[-1]["createTime"]),
+                )
+            # Commit each page, so an interrupted sync keeps what it fetched
+            _connection.commit()
+        added += len(messages)
+
+        if "nextPageToken" in data:
+            params["pageToken"] = data["nextPageToken"]
+        else:
+            break
+
+    print(f"Synced {space_name}: {added} new messages.")
+    return added
+
+
+def get_messages(space_name):
+    """Every stored message in `space_name`, oldest first."""
+    open_store()
+    with _lock:
+        rows = _connection.execute(
+            "SELECT message FROM messages WHERE space_name = ? ORDER BY create_time",
+            (space_name,),
+        ).fetchall()
+    return [json.loads(row[0]) for row in rows]
@@ -0,0 +1,64 @@
+"""
+Idempotent delivery of Chat messages.
+
+Each message we send is given a client-assigned messageId (and the same
+requestId) derived from a hash of (space, template, group).  Chat refuses a
+second message with the same messageId, and returns the original message for
+a repeated requestId, so resending after a crash or on a rerun never posts
+twice.  Every delivery is also appended to a local ledger, so a rerun knows
+which messages were already sent without reading any messages back.
+"""
+
+import hashlib
+import json
+import threading
+from datetime import datetime, timezone
+
+import json_files
+
+LEDGER_FILE = "sent_messages.jsonl"
+
+_sent = None
+_lock = threading.Lock()
+
+
+def message_id(space_name, template, group_name):
+    """
+    The client-assigned messageId for sending `template` to `group_name` in
+    `space_name`: "client-" followed by lowercase hex, 63 characters in all.
+    """
+    digest = hashlib.sha256(
+        json.dumps([space_name, template, group_name]).encode("utf-8")
+    ).hexdigest()
+    return f"client-{digest[:56]}"
+
+
+def _load(path=LEDGER_FILE):
+    global _sent
+    if _sent is None:
+        _sent = {
+            entry["message_id"]: entry for entry in json_files.read_jsonl(path)
+        }
+    return _sent
+
+
+def is_sent(message_id, path=LEDGER_FILE):
+    with _lock:
+        return message_id in _load(path)
+
+
+def record_sent(
+    message_id, space_name, template, group_name, message_name=None, path=LEDGER_FILE
+):
+    entry = {
+        "message_id": message_id,
+        "space_name": space_name,
+        "template": template,
+        "group_name": group_name,
+        "message_name": message_name,
+        "time": datetime.now(timezone.utc).isoformat(),
+    }
+    with _lock:
+        _load(path)
+        json_files.append_jsonl(path, entry)
+        _sent[message_id] = entry
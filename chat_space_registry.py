@@ -0,0 +1,148 @@
+"""
+Registry of the Google Chat spaces we belong to, indexed by displayName and
+by space name (spaces/XXXX).
+
+The first lookup lists every space with one paginated spaces.list; after
+that, lookups are dictionary reads.  Spaces we create are recorded with
+add_space(), so the registry stays correct for the rest of the run without
+listing again.
+
+If open_registry() has been called with a file, the registry is saved there
+with the time it was listed, and a later run reuses it for up to
+MAX_AGE_SECONDS instead of listing again.  A lookup that misses a registry
+read from the file lists the spaces again before answering, so a space
+created elsewhere since then is never missed.
+"""
+
+import threading
+import time
+
+import json_files
+import rate_limits
+
+SPACES_URL = "https://chat.googleapis.com/v1/spaces"
+MAX_AGE_SECONDS = 60 * 60  # one hour
+
+_by_display_name = {}
+_by_name = {}
+# None until the spaces have been listed (or read from the file)
+_listed_at = None
+# True if the registry came from the file rather than spaces.list this run
+_from_file = False
+_path = None
+_lock = threading.RLock()
+
+
+def list_all_spaces(session):
+    """Every space we belong to, following every page of spaces.list."""
+    params = {"pageSize": 1000}
+
+    all_spaces = []
+
+    while True:
+        response = rate_limits.send(session, "GET", SPACES_URL, "chat", params=params)
+        if response.status_code != 200:
+            print(f"⚠️ Failed to list spaces: {response.status_code} {response.text}")
+            break
+
+        data = response.json()
+        all_spaces.extend(data.get("spaces", []))
+
+        if "nextPageToken" in data:
+            params["pageToken"] = data["nextPageToken"]
+        else:
+            break
+
+    return all_spaces
+
+
+def open_registry(session, path, max_age=MAX_AGE_SECONDS):
+    """Keep the registry in `path` between runs, reusing it if it is younger than `max_age` seconds."""
+    global _path, _listed_at, _from_file
+    with _lock:
+        _path = path
+        saved = json_files.read_json(path)
+        if saved is None:
+            return
+        age = time.time() - saved.get("listed_at", 0)
+        if age > max_age:
+            print(f"Space registry {path} is {age / 60:.0f} minutes old; listing again.")
+            return
+        _fill(saved.get("spaces", []))
+        _listed_at = saved["listed_at"]
+        _from_file = True
+        print(f"Space registry {path}: {len(_by_name)} spaces.")
+
+
+def invalidate():
+    """Forget every space, so the next lookup lists them again."""
+    global _listed_at, _from_file
+    with _lock:
+        _by_display_name.clear()
+        _by_name.clear()
+        _listed_at = None
+        _from_file = False
+
+
+def _fill(spaces):
+    _by_display_name.clear()
+    _by_name.clear()
+    for space in spaces:
+        _by_name[space["name"]] = space
+        if space.get("displayName"):
+            _by_display_name[space["displayName"]] = space
+
+
+def _save():
+    if _path is None:
+        return
+    json_files.write_json(
+        _path, {"listed_at": _listed_at, "spaces": list(_by_name.values())}
+    )
+
+
+def _refresh(session):
+    global _listed_at, _from_file
+    _fill(list_all_spaces(session))
+    _listed_at = time.time()
+    _from_file = False
+    _save()
+
+
+def _lookup(session, index, key):
+    with _lock:
+        if _listed_at is None:
+            _refresh(session)
+        space = index.get(key)
+        if space is None and _from_file:
+            # The saved registry may predate this space
+            _refresh(session)
+            space = index.get(key)
+        return space
+
+
+def find_by_display_name(session, display_name):
+    """Return the space called `display_name`, or None."""
+    return _lookup(session, _by_display_name, display_name)
+
+
+def find_by_name(session, space_name):
+    """Return the space `space_name` (spaces/XXXX), or None."""
+    return _lookup(session, _by_name, space_name)
+
+
+def all_spaces(session):
+    with _lock:
+        if _listed_at is None:
+            _refresh(session)
+        return list(_by_name.values())
+
+
+def add_space(space):
+    """Record a space we created."""
+    with _lock:
+        _by_name[space["name"]] = space
+        if space.get("displayName"):
+            _by_display_name[space["displayName"]] = space
+        if _listed_at is not None:
+            _save()
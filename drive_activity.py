@@ -0,0 +1,99 @@
+"""
+Who edited what, for a whole project folder at once.
+
+Instead of one Drive Activity query per file and one people.get per editor,
+editors_by_file() queries every EDIT activity under the project folder
+(ancestorName), following every page, and groups the actors by target file.
+resolve_people() then looks up the distinct editors through identity_cache,
+which only asks people.getBatchGet about people it hasn't seen recently.
+"""
+
+import google_services
+import identity_cache
+import rate_limits
+
+EDIT_FILTER = "detail.action_detail_case:EDIT"
+
+
+def iter_edit_activities(activity_service, folder_id=None, file_id=None):
+    """Yield every EDIT activity on any file under the folder `folder_id`, or on `file_id`."""
+    page_token = None
+    while True:
+        if folder_id:
+            body = {"ancestorName": f"items/{folder_id}", "filter": EDIT_FILTER}
+        else:
+            body = {"itemName": f"items/{file_id}", "filter": EDIT_FILTER}
+        if page_token:
+            body["pageToken"] = page_token
+        response = rate_limits.execute(
+            activity_service.activity().query(body=body),
+            "driveactivity",
+            idempotent=True,  # a read, even though it is sent as a POST
+        )
+        yield from response.get("activities", [])
+        page_token = response.get("nextPageToken")
+        if not page_token:
+            return
+
+
+def editors_by_file(activity_service, folder_id):
+    """Return {file_id: set of editors' person resource names} for every file under `folder_id`."""
+    editors = {}
+    for activity in iter_edit_activities(activity_service, folder_id):
+        people = set()
+        for actor in activity.get("actors", []):
+            known_user = actor.get("user", {}).get("knownUser", {})
+            if known_user.get("personName"):
+                people.add(known_user["personName"])
+        for target in activity.get("targets", []):
+            item_name = target.get("driveItem", {}).get("name", "")
+            if item_name.startswith("items/"):
+                editors.setdefault(item_name.removeprefix("items/"), set()).update(
+                    people
+                )
+    return editors
+
+
+def _person_entry(person_resource_name, person):
+    names = person.get("names", [])
+    emails = person.get("emailAddresses", [])
+    return {
+        "display_name": names[0]["displayName"] if names else "Unknown",
+        "email": emails[0]["value"] if emails else "No email",
+        "person_resource_name": person_resource_name,
+    }
+
+
+def resolve_people(people_service, person_resource_names):
+    """
+    Return {person resource name: {display_name, email, person_resource_name}},
+    looking up only the people not already in identity_cache.
+    """
+    people = identity_cache.get_people(
+        list(person_resource_names), identity_cache.fetch_with_service(people_service)
+    )
+    resolved = {}
+    for person_resource_name, person in people.items():
+        if person:
+            resolved[person_resource_name] = _person_entry(person_resource_name, person)
+        else:
+            resolved[person_resource_name] = {
+                "display_name": None,
+                "email": None,
+                "person_resource_name": person_resource_name,
+                "error": "Person not found",
+            }
+    return resolved
+
+
+def list_editors_by_file(activity_service, folder_id):
+    """Return {file_id: [editor]} for every file under `folder_id`, with each editor resolved."""
+    editors = editors_by_file(activity_service, folder_id)
+    people_service = google_services.get_service_like(activity_service, "people", "v1")
+    people = resolve_people(
+        people_service, set().union(*editors.values()) if editors else set()
+    )
+    return {
+        file_id: [people[person] for person in sorted(file_editors)]
+        for file_id, file_editors in editors.items()
+    }
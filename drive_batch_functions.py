@@ -0,0 +1,146 @@
+import time
+
+from googleapiclient.errors import HttpError
+
+import rate_limits
+
+# Drive accepts up to 100 calls in a single batch request
+BATCH_SIZE = 100
+MAX_RETRIES = 5
+
+
+def create_folder_request(service, name, parent_id):
+    """Request creating a folder called `name` inside `parent_id`."""
+    metadata = {
+        "name": name,
+        "mimeType": "application/vnd.google-apps.folder",
+        "parents": [parent_id],
+    }
+    return service.files().create(body=metadata, fields="id, name, mimeType")
+
+
+def share_folder_request(service, file_id, email):
+    """Request giving the user with the email address `email` write access to `file_id`."""
+    permission = {"type": "user", "role": "writer", "emailAddress": email}
+    return service.permissions().create(
+        fileId=file_id, body=permission, fields="id", sendNotificationEmail=False
+    )
+
+
+def copy_file_request(service, file_id, new_name, parent_id):
+    """Request copying `file_id` into the folder `parent_id` as `new_name`."""
+    copied_file = {"name": new_name, "parents": [parent_id]}
+    return service.files().copy(
+        fileId=file_id, body=copied_file, fields="id, name, mimeType, appProperties"
+    )
+
+
+def rename_file_request(service, file_id, new_name):
+    """Request renaming `file_id` to `new_name`."""
+    return service.files().update(fileId=file_id, body={"name": new_name})
+
+
+def move_file_request(service, file_id, src_id, dest_id, app_properties=None):
+    """Request moving `file_id` from folder `src_id` into folder `dest_id`."""
+    return service.files().update(
+        fileId=file_id,
+        addParents=dest_id,
+        removeParents=src_id,
+        body={"appProperties": app_properties} if app_properties else {},
+        fields="id, parents, appProperties",
+    )
+
+
+def stamp_file_request(service, file_id, app_properties):
+    """Request setting `app_properties` (see artifact_stamps) on `file_id`."""
+    return service.files().update(
+        fileId=file_id,
+        body={"appProperties": app_properties},
+        fields="id, appProperties",
+    )
+
+
+def delete_file_request(service, file_id):
+    """Request deleting `file_id`."""
+    return service.files().delete(fileId=file_id)
+
+
+def execute_batch(service, requests, batch_size=BATCH_SIZE, max_retries=MAX_RETRIES):
+    """
+    Send a dictionary of Drive requests in batches of up to `batch_size`.
+
+    `requests` maps a caller chosen key (e.g. "share Group 1 someone@ucsb.edu")
+    to an unexecuted request built by one of the *_request functions above.
+
+    Sub-requests are paced by the rate_limits Drive bucket.  Those that fail
+    with a rate limit error, or with a server error if they are safe to repeat
+    (not creates or copies), are collected and only those are sent again,
+    with exponential backoff, up to `max_retries` times.
+
+    Returns a pair of dictionaries (results, errors), both keyed by the keys of
+    `requests`: results holds the response of each successful sub-request,
+    errors holds the exception of each sub-request that ultimately failed.
+    """
+    results = {}
+    errors = {}
+    pending = dict(requests)
+    failed = {}
+
+    for attempt in range(max_retries + 1):
+        if not pending:
+            break
+        if attempt > 0:
+            delay = rate_limits.backoff_delay(attempt)
+            print(
+                f"Retrying {len(pending)} failed Drive requests in {delay:.1f} seconds..."
+            )
+            time.sleep(delay)
+
+        failed = {}
+        keys = list(pending.keys())
+        for start in range(0, len(keys), batch_size):
+            chunk = keys[start : start + batch_size]
+
+            def callback(request_id, response, exception, chunk=chunk):
+                key = chunk[int(request_id)]
+                if exception is None:
+                    results[key] = response
+                elif rate_limits.is_retryable_error(
+                    exception, rate_limits.is_idempotent_request(pending[key])
+                ):
+                    failed[key] = exception
+                else:
+                    print(f"Drive request '{key}' failed: {exception}")
+                    errors[key] = exception
+
+            batch = service.new_batch_http_request(callback=callback)
+            for i, key in enumerate(chunk):
+                # Each sub-request counts against the Drive quota
+                rate_limits.acquire("drive")
+                batch.add(pending[key], request_id=str(i))
+            try:
+                batch.execute()
+            except HttpError as error:
+                # The batch request as a whole failed; after a server error
+                # some sub-requests may have run, so only repeat the safe ones
+                if not rate_limits.is_retryable_error(error):
+                    raise
+                for key in chunk:
+                    if rate_limits.is_retryable_error(
+                        error, rate_limits.is_idempotent_request(pending[key])
+                    ):
+                        failed[key] = error
+                    else:
+                        print(f"Drive request '{key}' failed: {error}")
+                        errors[key] = error
+
+        pending = {key: pending[key] for key in failed}
+
+    for key, exception in failed.items():
+        print(f"Drive request '{key}' failed after {max_retries} retries: {exception}")
+        errors[key] = exception
+
+    print(
+        f"Drive batch complete: {len(results)} succeeded, {len(errors)} failed."
+    )
+    return results, errors
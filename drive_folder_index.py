@@ -0,0 +1,259 @@
+"""
+In-memory index of the children of Drive folders.
+
+The first lookup under a parent folder lists all of its children (following
+every page of results, through drive_listing); later lookups by name and mimeType under that parent
+are answered from memory.  Our own creates, copies, moves, renames and deletes
+are recorded with add_file, move_file, rename_file and remove_file, so the
+index stays correct for the rest of the run without listing again.
+
+If drive_metadata_cache has been opened, listings are read from (and saved
+to) the on-disk cache, so they survive between runs.  Our own changes are
+written through to the cache as well, so a folder listed again later in the
+run (or in the next run) sees them.  A folder whose cached listing can't be
+brought up to date that way, and every folder after clear(), is listed from
+Drive instead.
+
+Drive is listed without holding the index lock, so several threads can list
+different folders at once; a per-folder lock keeps two threads from listing
+the same folder twice.
+"""
+
+import contextlib
+import threading
+
+import drive_listing
+import drive_metadata_cache
+
+FOLDER_MIME_TYPE = drive_listing.FOLDER_MIME_TYPE
+
+# parent_id -> {file_id: file}
+_children = {}
+# name -> folder, for folders looked up without a parent
+_top_level_folders = {}
+_lock = threading.RLock()
+# parent_id (or top level folder name) -> lock held while listing it
+_fetch_locks = {}
+# Folders whose cached listing is missing one of our own changes
+_relist = set()
+# Set by clear(): the cached listings predate changes made by someone else
+_disk_cache_stale = False
+
+
+def _fetch_lock(key):
+    with _lock:
+        return _fetch_locks.setdefault(key, threading.Lock())
+
+
+def clear():
+    """Forget everything, e.g. if Drive has been changed by someone else."""
+    global _disk_cache_stale
+    with _lock:
+        _children.clear()
+        _top_level_folders.clear()
+        _disk_cache_stale = True
+
+
+def _cached_children(parent_id):
+    """The cached listing of `parent_id`, or None if it isn't cached or is out of date."""
+    with _lock:
+        if _disk_cache_stale or parent_id in _relist:
+            return None
+    if not drive_metadata_cache.is_open():
+        return None
+    return drive_metadata_cache.get_children(parent_id)
+
+
+def _store_children(parent_id, files):
+    if drive_metadata_cache.is_open():
+        drive_metadata_cache.store_children(parent_id, files)
+    with _lock:
+        _relist.discard(parent_id)
+
+
+def _fetch_children(service, parent_id):
+    files = _cached_children(parent_id)
+    if files is not None:
+        return files
+
+    files = list(drive_listing.iter_children(service, parent_id))
+    _store_children(parent_id, files)
+    return files
+
+
+def list_children(service, parent_id):
+    """Return all files and folders in `parent_id`, listing it only the first time."""
+    with _fetch_lock(parent_id):
+        with _lock:
+            if parent_id in _children:
+                return list(_children[parent_id].values())
+        files = _fetch_children(service, parent_id)
+        with _lock:
+            children = _children.setdefault(
+                parent_id, {file["id"]: file for file in files}
+            )
+            return list(children.values())
+
+
+def list_children_of_many(service, parent_ids):
+    """
+    Return {parent_id: children} for every folder in `parent_ids`.  The folders
+    that are neither indexed nor cached are listed together, with a few
+    chunked queries (drive_listing.iter_children_of_many) instead of one
+    listing per folder.
+    """
+    with _lock:
+        unindexed = sorted(set(parent_ids) - set(_children))
+
+    # Take the folders' locks in sorted order, so two callers never deadlock
+    with contextlib.ExitStack() as stack:
+        for parent_id in unindexed:
+            stack.enter_context(_fetch_lock(parent_id))
+
+        missing = []
+        for parent_id in unindexed:
+            with _lock:
+                if parent_id in _children:
+                    continue
+            files = _cached_children(parent_id)
+            if files is not None:
+                with _lock:
+                    _children.setdefault(
+                        parent_id, {file["id"]: file for file in files}
+                    )
+            else:
+                missing.append(parent_id)
+
+        if missing:
+            listed = {parent_id: {} for parent_id in missing}
+            for file in drive_listing.iter_children_of_many(service, missing):
+                for parent_id in file.get("parents", []):
+                    if parent_id in listed:
+                        listed[parent_id][file["id"]] = file
+            for parent_id, files in listed.items():
+                _store_children(parent_id, list(files.values()))
+                with _lock:
+                    _children.setdefault(parent_id, files)
+
+    with _lock:
+        return {
+            parent_id: list(_children[parent_id].values()) for parent_id in parent_ids
+        }
+
+
+def find_children(service, parent_id, name, mime_type=None):
+    """Return every child of `parent_id` called `name` (and of type `mime_type`, if given)."""
+    return [
+        file
+        for file in list_children(service, parent_id)
+        if file["name"] == name
+        and (mime_type is None or file.get("mimeType") == mime_type)
+    ]
+
+
+def find_child(service, parent_id, name, mime_type=None):
+    """Return the first child of `parent_id` called `name`, or None."""
+    files = find_children(service, parent_id, name, mime_type)
+    return files[0] if files else None
+
+
+def find_top_level_folder(service, name):
+    """Find a folder by name anywhere in Drive, querying only the first time."""
+    with _fetch_lock(("top level", name)):
+        with _lock:
+            if name in _top_level_folders:
+                return _top_level_folders[name]
+        folder = None
+        if drive_metadata_cache.is_open() and not _disk_cache_stale:
+            folders = drive_metadata_cache.find_files_by_name(name, FOLDER_MIME_TYPE)
+            if folders:
+                folder = folders[0]
+        if folder is None:
+            query = (
+                f"name = {drive_listing.quote(name)} and "
+                f"mimeType = '{FOLDER_MIME_TYPE}' and trashed = false"
+            )
+            folder = drive_listing.find_first(service, query)
+            if not folder:
+                return None
+            if drive_metadata_cache.is_open():
+                drive_metadata_cache.store_file(folder)
+        with _lock:
+            return _top_level_folders.setdefault(name, folder)
+
+
+def resolve_path(service, names):
+    """
+    Resolve a path of folder names, e.g. ["cs5a-s25-ic12", "Initial Contents"],
+    starting from a top level folder.  Returns the last folder, or None.
+    """
+    folder = find_top_level_folder(service, names[0])
+    for name in names[1:]:
+        if not folder:
+            return None
+        folder = find_child(service, folder["id"], name, FOLDER_MIME_TYPE)
+    return folder
+
+
+def add_file(parent_id, file):
+    """Record a file we created or copied into `parent_id`."""
+    with _lock:
+        if parent_id in _children:
+            _children[parent_id][file["id"]] = file
+    if drive_metadata_cache.is_open():
+        drive_metadata_cache.store_file({**file, "parents": [parent_id]})
+
+
+def add_top_level_folder(folder):
+    """Record a folder we created without a parent."""
+    with _lock:
+        _top_level_folders[folder["name"]] = folder
+    if drive_metadata_cache.is_open():
+        drive_metadata_cache.store_file(folder)
+
+
+def remove_file(file_id):
+    """Record that we deleted `file_id`."""
+    with _lock:
+        for files in _children.values():
+            files.pop(file_id, None)
+        _children.pop(file_id, None)
+    if drive_metadata_cache.is_open():
+        drive_metadata_cache.remove_file(file_id)
+
+
+def move_file(file_id, src_id, dest_id):
+    """Record that we moved `file_id` from folder `src_id` to folder `dest_id`."""
+    with _lock:
+        file = _children.get(src_id, {}).pop(file_id, None)
+        if file is not None and dest_id in _children:
+            _children[dest_id][file_id] = file
+        elif dest_id in _children:
+            # We don't know the file's details, so list dest again next time
+            del _children[dest_id]
+    if drive_metadata_cache.is_open() and not drive_metadata_cache.move_file(
+        file_id, src_id, dest_id
+    ):
+        # The cached listing of dest can't be given the file either
+        with _lock:
+            _relist.add(dest_id)
+
+
+def rename_file(file_id, new_name):
+    """Record that we renamed `file_id` to `new_name`."""
+    with _lock:
+        for files in _children.values():
+            if file_id in files:
+                files[file_id]["name"] = new_name
+    if drive_metadata_cache.is_open():
+        drive_metadata_cache.rename_file(file_id, new_name)
+
+
+def set_app_properties(file_id, app_properties):
+    """Record that we set `app_properties` on `file_id`."""
+    with _lock:
+        for files in _children.values():
+            if file_id in files:
+                files[file_id].setdefault("appProperties", {}).update(app_properties)
+    if drive_metadata_cache.is_open():
+        drive_metadata_cache.set_app_properties(file_id, app_properties)
@@ -0,0 +1,84 @@
+"""
+Streaming, fully paginated Drive files.list.
+
+iter_files() is a generator: it asks for pages of up to 1000 files (the most
+Drive returns per page), fetches each page only when the previous one has
+been consumed, and follows nextPageToken until the listing is complete.
+Requests carry a fields mask naming only the file fields the caller needs, so
+responses stay small.
+
+Callers that stop early (e.g. after the first match) never fetch the pages
+they don't need, and callers that don't keep the files never hold more than
+one page in memory.
+"""
+
+import rate_limits
+
+# files.list returns at most 1000 files per page
+PAGE_SIZE = 1000
+
+FOLDER_MIME_TYPE = "application/vnd.google-apps.folder"
+
+# Folders per query in iter_children_of_many, keeping the query well under
+# the length Drive accepts
+PARENTS_PER_QUERY = 50
+
+# The file fields drive_folder_index and drive_metadata_cache keep
+FILE_FIELDS = "id, name, mimeType, parents, createdTime, modifiedTime, md5Checksum, appProperties"
+
+
+def quote(value):
+    """Quote `value` as a string literal in a Drive query."""
+    escaped = value.replace("\\", "\\\\").replace("'", "\\'")
+    return f"'{escaped}'"
+
+
+def iter_files(service, query, fields=FILE_FIELDS, page_size=PAGE_SIZE):
+    """Yield every file matching the Drive `query`, one page at a time."""
+    page_token = None
+    while True:
+        results = rate_limits.execute(
+            service.files().list(
+                q=query,
+                spaces="drive",
+                pageSize=page_size,
+                fields=f"nextPageToken, files({fields})",
+                pageToken=page_token,
+            ),
+            "drive",
+        )
+        yield from results.get("files", [])
+        page_token = results.get("nextPageToken")
+        if not page_token:
+            return
+
+
+def iter_children(service, parent_id, fields=FILE_FIELDS, name=None, mime_type=None):
+    """Yield every file in the folder `parent_id` (called `name`, of type `mime_type`, if given)."""
+    query = f"{quote(parent_id)} in parents and trashed = false"
+    if name is not None:
+        query += f" and name = {quote(name)}"
+    if mime_type is not None:
+        query += f" and mimeType = {quote(mime_type)}"
+    return iter_files(service, query, fields)
+
+
+def iter_children_of_many(
+    service, parent_ids, fields=FILE_FIELDS, parents_per_query=PARENTS_PER_QUERY
+):
+    """
+    Yield the files in every folder in `parent_ids`, listing up to
+    `parents_per_query` folders per query ("'a' in parents or 'b' in parents ...")
+    instead of one query per folder.  `fields` should include parents, so the
+    caller can tell which folder each file is in.
+    """
+    parent_ids = list(parent_ids)
+    for start in range(0, len(parent_ids), parents_per_query):
+        chunk = parent_ids[start : start + parents_per_query]
+        in_parents = " or ".join(f"{quote(parent_id)} in parents" for parent_id in chunk)
+        yield from iter_files(service, f"({in_parents}) and trashed = false", fields)
+
+
+def find_first(service, query, fields=FILE_FIELDS):
+    """Return the first file matching `query`, or None, fetching a single page at most."""
+    return next(iter_files(service, query, fields), None)
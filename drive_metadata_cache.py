@@ -0,0 +1,271 @@
+"""
+Persistent on-disk cache of Google Drive file and folder metadata.
+
+The cache is a SQLite file holding (id, name, parents, mimeType, createdTime,
+modifiedTime, md5Checksum, appProperties) for every file we have listed, plus
+the Drive changes.getStartPageToken watermark.  On startup, sync() asks changes.list
+for everything that changed since the watermark and applies it, so a rerun
+after a small change costs one changes call instead of re-listing every folder.
+
+drive_folder_index reads folder listings from here once open_cache() has been
+called; make_group_notebook_folders.authenticate() does that.
+"""
+
+import json
+import os
+import sqlite3
+import threading
+
+import rate_limits
+
+CACHE_FILE = "drive_cache.sqlite"
+FILE_FIELDS = "id, name, parents, mimeType, createdTime, modifiedTime, md5Checksum, appProperties, trashed"
+
+_connection = None
+_lock = threading.RLock()
+
+
+def is_open():
+    return _connection is not None
+
+
+def open_cache(service, path=CACHE_FILE):
+    """Open (creating if needed) the cache at `path` and bring it up to date."""
+    global _connection
+    new_cache = not os.path.exists(path)
+    with _lock:
+        _connection = sqlite3.connect(path, check_same_thread=False)
+        _connection.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS files (
+                id TEXT PRIMARY KEY,
+                name TEXT,
+                parents TEXT,
+                mimeType TEXT,
+                createdTime TEXT,
+                modifiedTime TEXT,
+                md5Checksum TEXT,
+                appProperties TEXT
+            );
+            CREATE TABLE IF NOT EXISTS parents (
+                file_id TEXT,
+                parent_id TEXT,
+                PRIMARY KEY (file_id, parent_id)
+            );
+            CREATE INDEX IF NOT EXISTS parents_by_parent ON parents (parent_id);
+            CREATE TABLE IF NOT EXISTS listed_folders (id TEXT PRIMARY KEY);
+            CREATE TABLE IF NOT EXISTS settings (key TEXT PRIMARY KEY, value TEXT);
+            """
+        )
+        columns = [row[1] for row in _connection.execute("PRAGMA table_info(files)")]
+        if "appProperties" not in columns:
+            # Caches made before artifact_stamps existed
+            _connection.execute("ALTER TABLE files ADD COLUMN appProperties TEXT")
+        _connection.commit()
+    if new_cache:
+        print(f"Created Drive metadata cache {path}.")
+    sync(service)
+
+
+def close_cache():
+    global _connection
+    with _lock:
+        if _connection is not None:
+            _connection.close()
+            _connection = None
+
+
+def _get_setting(key):
+    row = _connection.execute(
+        "SELECT value FROM settings WHERE key = ?", (key,)
+    ).fetchone()
+    return row[0] if row else None
+
+
+def _set_setting(key, value):
+    _connection.execute(
+        "INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)", (key, value)
+    )
+
+
+def _row_to_file(row):
+    return {
+        "id": row[0],
+        "name": row[1],
+        "parents": json.loads(row[2]) if row[2] else [],
+        "mimeType": row[3],
+        "createdTime": row[4],
+        "modifiedTime": row[5],
+        "md5Checksum": row[6],
+        "appProperties": json.loads(row[7]) if row[7] else {},
+    }
+
+
+def _upsert_file(file):
+    parents = file.get("parents", [])
+    _connection.execute(
+        "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+        (
+            file["id"],
+            file.get("name"),
+            json.dumps(parents),
+            file.get("mimeType"),
+            file.get("createdTime"),
+            file.get("modifiedTime"),
+            file.get("md5Checksum"),
+            json.dumps(file.get("appProperties") or {}),
+        ),
+    )
+    _connection.execute("DELETE FROM parents WHERE file_id = ?", (file["id"],))
+    _connection.executemany(
+        "INSERT INTO parents VALUES (?, ?)",
+        [(file["id"], parent_id) for parent_id in parents],
+    )
+
+
+def _delete_file(file_id):
+    _connection.execute("DELETE FROM files WHERE id = ?", (file_id,))
+    _connection.execute("DELETE FROM parents WHERE file_id = ?", (file_id,))
+    _connection.execute("DELETE FROM listed_folders WHERE id = ?", (file_id,))
+
+
+def _is_tracked(file):
+    """True if `file` is already cached or lives in a folder whose listing we cache."""
+    if _connection.execute(
+        "SELECT 1 FROM files WHERE id = ?", (file["id"],)
+    ).fetchone():
+        return True
+    for parent_id in file.get("parents", []):
+        if _connection.execute(
+            "SELECT 1 FROM listed_folders WHERE id = ?", (parent_id,)
+        ).fetchone():
+            return True
+    return False
+
+
+def sync(service):
+    """Apply every Drive change since the stored watermark to the cache."""
+    with _lock:
+        page_token = _get_setting("startPageToken")
+        if page_token is None:
+            # Nothing is cached yet, so there is nothing to bring up to date
+            response = rate_limits.execute(
+                service.changes().getStartPageToken(), "drive"
+            )
+            _set_setting("startPageToken", response["startPageToken"])
+            _connection.commit()
+            return
+
+        applied = 0
+        while page_token:
+            response = rate_limits.execute(
+                service.changes().list(
+                    pageToken=page_token,
+                    spaces="drive",
+                    pageSize=1000,
+                    fields=f"nextPageToken, newStartPageToken, changes(fileId, removed, file({FILE_FIELDS}))",
+                ),
+                "drive",
+            )
+            for change in response.get("changes", []):
+                file = change.get("file")
+                if change.get("removed") or not file or file.get("trashed"):
+                    _delete_file(change["fileId"])
+                elif _is_tracked(file):
+                    _upsert_file(file)
+                applied += 1
+            page_token = response.get("nextPageToken")
+            if "newStartPageToken" in response:
+                _set_setting("startPageToken", response["newStartPageToken"])
+        _connection.commit()
+        print(f"Drive metadata cache synced ({applied} changes).")
+
+
+def get_children(parent_id):
+    """Return the cached children of `parent_id`, or None if it has never been listed."""
+    with _lock:
+        if not _connection.execute(
+            "SELECT 1 FROM listed_folders WHERE id = ?", (parent_id,)
+        ).fetchone():
+            return None
+        rows = _connection.execute(
+            "SELECT files.* FROM files JOIN parents ON files.id = parents.file_id "
+            "WHERE parents.parent_id = ?",
+            (parent_id,),
+        ).fetchall()
+        return [_row_to_file(row) for row in rows]
+
+
+def store_children(parent_id, files):
+    """Cache the complete listing of `parent_id`."""
+    with _lock:
+        for file in files:
+            _upsert_file(file)
+        _connection.execute(
+            "INSERT OR REPLACE INTO listed_folders VALUES (?)", (parent_id,)
+        )
+        _connection.commit()
+
+
+def store_file(file):
+    """Cache a single file, e.g. a top level folder found by name."""
+    with _lock:
+        _upsert_file(file)
+        _connection.commit()
+
+
+def find_files_by_name(name, mime_type):
+    with _lock:
+        rows = _connection.execute(
+            "SELECT * FROM files WHERE name = ? AND mimeType = ?", (name, mime_type)
+        ).fetchall()
+        return [_row_to_file(row) for row in rows]
+
+
+def get_file(file_id):
+    with _lock:
+        row = _connection.execute(
+            "SELECT * FROM files WHERE id = ?", (file_id,)
+        ).fetchone()
+        return _row_to_file(row) if row else None
+
+
+def remove_file(file_id):
+    """Record that we deleted `file_id`."""
+    with _lock:
+        _delete_file(file_id)
+        _connection.commit()
+
+
+def move_file(file_id, src_id, dest_id):
+    """
+    Record that we moved `file_id` from `src_id` to `dest_id`.  Returns False
+    if the file isn't cached, so the cached listing of `dest_id` lacks it.
+    """
+    with _lock:
+        file = get_file(file_id)
+        if file is None:
+            return False
+        file["parents"] = [
+            parent_id for parent_id in file["parents"] if parent_id != src_id
+        ] + [dest_id]
+        _upsert_file(file)
+        _connection.commit()
+        return True
+
+
+def rename_file(file_id, new_name):
+    """Record that we renamed `file_id` to `new_name`."""
+    with _lock:
+        _connection.execute("UPDATE files SET name = ? WHERE id = ?", (new_name, file_id))
+        _connection.commit()
+
+
+def set_app_properties(file_id, app_properties):
+    """Record that we set `app_properties` on `file_id`."""
+    with _lock:
+        file = get_file(file_id)
+        if file is not None:
+            file["appProperties"].update(app_properties)
+            _upsert_file(file)
+            _connection.commit()
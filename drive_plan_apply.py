@@ -0,0 +1,345 @@
+"""
+Two-phase (plan, then apply) provisioning of group folders.
+
+plan_group_folders() compares the groups from the group export CSV with a
+snapshot of the projects folder on Drive and writes the operations needed to
+make Drive match, one JSON object per line:
+
+    {"op": "create_folder", "group": ..., "parent_id": ...}
+    {"op": "add_permission", "group": ..., "folder_id": ..., "email": ...}
+    {"op": "copy_template", "group": ..., "folder_id": ..., "template_id": ..., "name": ..., "members": [...], "inputs_hash": ..., "replace_ids": [...]}
+    {"op": "update_sheet", "group": ..., "folder_id": ..., "members": [...], "sheet_id": ...}
+
+folder_id is null when the folder is created by an earlier operation in the
+same plan.  Existing retro files and member sheets are only replanned when
+their artifact_stamps stamp no longer matches the roster and template:
+replace_ids lists the stale retro files to delete, and sheet_id is the stale
+sheet that gets a new tab (null for a sheet that doesn't exist yet).  Member
+sheets made before stamping was added are replanned if their values differ
+from the roster; retro files made then have no stamp and are replaced, just
+as provision_group replaces them.
+
+apply_plan() streams the file and sends the Drive operations through
+drive_batch_functions.  When Drive already matches the roster, the plan is
+empty and apply does nothing.
+"""
+
+import json
+
+import artifact_stamps
+import drive_batch_functions
+import drive_folder_index
+import drive_listing
+import make_group_notebook_folders
+
+PLAN_FILE = "plan.jsonl"
+
+
+def list_group_folders_with_permissions(service, projects_folder_id):
+    """Yield the folders in the projects folder along with who they are shared with."""
+    return drive_listing.iter_children(
+        service,
+        projects_folder_id,
+        fields="id, name, permissions(emailAddress, role)",
+        mime_type=drive_folder_index.FOLDER_MIME_TYPE,
+    )
+
+
+def member_fields(members):
+    return [
+        {"student_name": member["student_name"], "email": member["email"]}
+        for member in members
+    ]
+
+
+def plan_group_folders(
+    service,
+    group_dict,
+    PROJECTS_FOLDER_NAME,
+    retroFileName="Retro1",
+    plan_file=PLAN_FILE,
+    filter=None,
+):
+    """Write the operations needed to provision every group in `group_dict` to `plan_file`."""
+    projects_folder = drive_folder_index.find_top_level_folder(
+        service, PROJECTS_FOLDER_NAME
+    )
+    if not projects_folder:
+        raise Exception(f"Projects folder {PROJECTS_FOLDER_NAME} not found.")
+    projects_id = projects_folder["id"]
+    template = make_group_notebook_folders.locate_retro_file_template(
+        service, projects_id, retroFileName
+    )
+
+    existing_folders = {
+        folder["name"]: folder
+        for folder in list_group_folders_with_permissions(service, projects_id)
+    }
+
+    counts = {}
+    groups = list(group_dict.keys())
+    groups.sort(key=make_group_notebook_folders.folder_name_sort_key)
+    with open(plan_file, "w") as f:
+
+        def add(op):
+            f.write(json.dumps(op) + "\n")
+            counts[op["op"]] = counts.get(op["op"], 0) + 1
+
+        for group in groups:
+            if group == "" or (filter and group not in filter):
+                continue
+            members = group_dict[group]["members"]
+            folder = existing_folders.get(group)
+
+            retro_name = f"{retroFileName}-{group}"
+            sheet_name = f"{group}_members"
+            retro_hash = make_group_notebook_folders.retro_file_hash(
+                template, group, members
+            )
+            sheet_hash = make_group_notebook_folders.member_sheet_hash(members)
+
+            if folder:
+                folder_id = folder["id"]
+                shared_with = {
+                    permission.get("emailAddress", "").lower()
+                    for permission in folder.get("permissions", [])
+                }
+                # One listing of the folder, appProperties included, says
+                # which artifacts are missing or stale
+                stale = artifact_stamps.find_stale_artifacts(
+                    service,
+                    folder_id,
+                    {retro_name: retro_hash, sheet_name: sheet_hash},
+                )
+                # A retro file without a stamp is replaced, as provision_group
+                # does; sheets made before stamping are compared by their
+                # values, as create_or_update_member_file_google_sheet does
+                sheet = stale.get(sheet_name)
+                if sheet and not artifact_stamps.get_stamp(sheet):
+                    values = make_group_notebook_folders.get_values_from_spreadsheet(
+                        service, sheet["id"]
+                    )
+                    if values == make_group_notebook_folders.get_values_for_spreadsheet(
+                        members
+                    ):
+                        del stale[sheet_name]
+            else:
+                folder_id = None
+                shared_with = set()
+                stale = {retro_name: None, sheet_name: None}
+                add({"op": "create_folder", "group": group, "parent_id": projects_id})
+
+            for member in members:
+                if member["email"].lower() not in shared_with:
+                    add(
+                        {
+                            "op": "add_permission",
+                            "group": group,
+                            "folder_id": folder_id,
+                            "email": member["email"],
+                        }
+                    )
+
+            if retro_name in stale:
+                replace_ids = []
+                if stale[retro_name]:
+                    replace_ids = [
+                        file["id"]
+                        for file in drive_folder_index.find_children(
+                            service, folder_id, retro_name
+                        )
+                    ]
+                add(
+                    {
+                        "op": "copy_template",
+                        "group": group,
+                        "folder_id": folder_id,
+                        "template_id": template["id"],
+                        "name": retro_name,
+                        "members": member_fields(members),
+                        "inputs_hash": retro_hash,
+                        "replace_ids": replace_ids,
+                    }
+                )
+
+            if sheet_name in stale:
+                add(
+                    {
+                        "op": "update_sheet",
+                        "group": group,
+                        "folder_id": folder_id,
+                        "members": member_fields(members),
+                        "sheet_id": stale[sheet_name] and stale[sheet_name]["id"],
+                    }
+                )
+
+    total = sum(counts.values())
+    print(f"Planned {total} operations to {plan_file}: {counts}")
+    return counts
+
+
+def read_plan(plan_file=PLAN_FILE):
+    """Yield the operations in `plan_file` one at a time."""
+    with open(plan_file) as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def apply_plan(service, plan_file=PLAN_FILE):
+    """Carry out the operations in `plan_file`."""
+    folder_ids = {}
+    parent_ids = {}
+    create_requests = {}
+    mutation_requests = {}
+    copies = {}
+    sheets = []
+
+    # Phase 1: create the missing folders, as one batch
+    for op in read_plan(plan_file):
+        if op["op"] == "create_folder":
+            create_requests[op["group"]] = drive_batch_functions.create_folder_request(
+                service, op["group"], op["parent_id"]
+            )
+            parent_ids[op["group"]] = op["parent_id"]
+    results, create_errors = drive_batch_functions.execute_batch(
+        service, create_requests
+    )
+    for group, folder in results.items():
+        folder_ids[group] = folder["id"]
+        drive_folder_index.add_file(parent_ids[group], folder)
+
+    # Phase 2: permissions and template copies, as batches
+    for op in read_plan(plan_file):
+        folder_id = op.get("folder_id") or folder_ids.get(op["group"])
+        if op["op"] == "create_folder":
+            continue
+        if not folder_id:
+            print(f"Skipping {op['op']} for {op['group']}: folder was not created.")
+            continue
+        if op["op"] == "add_permission":
+            mutation_requests[f"share {op['group']} {op['email']}"] = (
+                drive_batch_functions.share_folder_request(
+                    service, folder_id, op["email"]
+                )
+            )
+        elif op["op"] == "copy_template":
+            for file_id in op.get("replace_ids", []):
+                mutation_requests[f"delete {op['group']} {file_id}"] = (
+                    drive_batch_functions.delete_file_request(service, file_id)
+                )
+            mutation_requests[f"copy {op['group']}"] = (
+                drive_batch_functions.copy_file_request(
+                    service, op["template_id"], op["name"], folder_id
+                )
+            )
+            copies[op["group"]] = (folder_id, op)
+        elif op["op"] == "update_sheet":
+            sheets.append((folder_id, op))
+    results, errors = drive_batch_functions.execute_batch(service, mutation_requests)
+    for key in results:
+        if key.startswith("delete "):
+            drive_folder_index.remove_file(key.split(" ")[-1])
+
+    # Phase 3: Sheets and Docs work that can't be batched through Drive.
+    # Each new member sheet is one spreadsheets.create; the moves into the
+    # group folders go out together as a Drive batch
+    move_requests = {}
+    sheet_files = {}
+    for folder_id, op in sheets:
+        if op.get("sheet_id"):
+            # The sheet exists but its member list is stale: add a new tab
+            make_group_notebook_folders.create_new_tab_member_file_google_sheet(
+                service, folder_id, op["group"], op["members"], [{"id": op["sheet_id"]}]
+            )
+            continue
+        app_properties = artifact_stamps.stamp(
+            make_group_notebook_folders.member_sheet_hash(op["members"])
+        )
+        sheet_id = make_group_notebook_folders.create_member_spreadsheet(
+            service, op["group"], op["members"]
+        )
+        key = f"move {op['group']}_members"
+        sheet_files[key] = (
+            folder_id,
+            {
+                "id": sheet_id,
+                "name": f"{op['group']}_members",
+                "mimeType": "application/vnd.google-apps.spreadsheet",
+                "appProperties": app_properties,
+            },
+        )
+        move_requests[key] = (
+            drive_batch_functions.move_file_request(
+                service, sheet_id, "root", folder_id, app_properties
+            )
+        )
+    move_results, move_errors = drive_batch_functions.execute_batch(
+        service, move_requests
+    )
+    errors.update(move_errors)
+    for key in move_results:
+        folder_id, sheet_file = sheet_files[key]
+        drive_folder_index.add_file(folder_id, sheet_file)
+
+    # Retro files: copies keep the template's tab IDs, so read the template only once.
+    member_tab_ids = {}
+    for template_id in {op["template_id"] for folder_id, op in copies.values()}:
+        template_document = make_group_notebook_folders.get_document_from_document_id(
+            service, template_id
+        )
+        member_tab_ids[template_id] = make_group_notebook_folders.get_member_tab_ids(
+            template_document
+        )
+    stamp_requests = {}
+    for group, (folder_id, op) in copies.items():
+        if f"copy {group}" not in results:
+            print(f"Skipping retro file for group {group}: copy failed.")
+            continue
+        copy = results[f"copy {group}"]
+        drive_folder_index.add_file(folder_id, copy)
+        make_group_notebook_folders.customize_retro_file_google_doc(
+            service,
+            copy["id"],
+            group,
+            op["members"],
+            member_tab_ids[op["template_id"]],
+        )
+        if op.get("inputs_hash"):
+            stamp_requests[f"stamp {group} {copy['id']}"] = (
+                drive_batch_functions.stamp_file_request(
+                    service, copy["id"], artifact_stamps.stamp(op["inputs_hash"])
+                )
+            )
+    # Stamp the customized copies together, as one more batch
+    stamp_results, stamp_errors = drive_batch_functions.execute_batch(
+        service, stamp_requests
+    )
+    errors.update(stamp_errors)
+    for key, response in stamp_results.items():
+        drive_folder_index.set_app_properties(response["id"], response["appProperties"])
+
+    errors.update(create_errors)
+    print(f"Applied {plan_file}: {len(errors)} Drive operations failed.")
+    return errors
+
+
+if __name__ == "__main__":
+
+    GROUP_CATEGORY_ID = "22640"  # You can get this from the URL in Canvas
+    PROJECTS_FOLDER_NAME = "cs5a-s25-midterm-folders"
+
+    service = make_group_notebook_folders.authenticate()
+
+    group_data = make_group_notebook_folders.csv_to_dict(
+        f"group_export_{GROUP_CATEGORY_ID}.csv"
+    )
+    group_dict = make_group_notebook_folders.make_group_dictionary(group_data)
+
+    counts = plan_group_folders(
+        service, group_dict, PROJECTS_FOLDER_NAME, retroFileName="Retro1"
+    )
+    if counts:
+        apply_plan(service)
+    else:
+        print("Drive already matches the roster; nothing to do.")
@@ -18,9 +18,19 @@ def convert_to_local_time(time_str):
     local_time = utc_time.astimezone(pytz.timezone("America/Los_Angeles"))
     return local_time.strftime("%m-%d %I:%M %p")
 
+def read_stored_chat_messages(session, group_folders):
+    """
+    Bring chat_message_store up to date with each group's space (fetching
+    only messages newer than the last sync), and return the chat message data
+    for every group, read from the store.
+    """
+    return make_google_chat_conversations.read_chat_messages(session, group_folders)
+
+
 def summarize_chat_messages(chat_message_data):
     """
     Summarize chat messages by email.
+    chat_message_data comes from read_stored_chat_messages.
     returns a dictionary where the keys are email addresses 
     and the values are dictionaries containing the messages and other information.
     
@@ -149,10 +159,10 @@ if __name__ == "__main__":
     # group_folders = make_google_chat_conversations.get_group_folders(GROUP_CATEGORY_ID)
     
 
-    # group_folders = make_google_chat_conversations.get_group_folders_with_chat(GROUP_CATEGORY_ID)
+    group_folders = make_google_chat_conversations.get_group_folders_with_chat(GROUP_CATEGORY_ID)
 
 
-    chat_message_data =  make_google_chat_conversations.read_chat_messages_given_groups(session, groups)
+    chat_message_data = read_stored_chat_messages(session, group_folders)
     print("chat_message_data *************************")
     pprint(chat_message_data)
     
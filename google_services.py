@@ -0,0 +1,40 @@
+"""
+Process-wide registry of Google API service objects.
+
+get_service() builds each client once per (api, version, credentials) and
+hands the same object back on every later call.  Services are built from the
+discovery documents bundled with google-api-python-client (static_discovery),
+so building one never fetches a discovery document over the network.
+
+googleapiclient services are not thread safe, so each thread gets its own.
+"""
+
+import threading
+
+from googleapiclient.discovery import build
+
+# (api, version, id(credentials), thread id) -> service
+_services = {}
+_lock = threading.Lock()
+
+
+def get_service(api, version, credentials):
+    key = (api, version, id(credentials), threading.get_ident())
+    with _lock:
+        service = _services.get(key)
+    if service is None:
+        service = build(
+            api,
+            version,
+            credentials=credentials,
+            static_discovery=True,
+            cache_discovery=False,
+        )
+        with _lock:
+            _services[key] = service
+    return service
+
+
+def get_service_like(service, api, version):
+    """Get the `api` service using the same credentials as an existing `service`."""
+    return get_service(api, version, service._http.credentials)
@@ -0,0 +1,134 @@
+"""
+Persistent cache of People API identities (display names and email addresses).
+
+Chat members, Chat message senders and Drive Activity editors all identify
+people by id; the same TA or student comes up over and over, across runs as
+well as within one.  get_people() answers from the cache file when it can,
+and looks up everyone else with People getBatchGet, up to 200 people per
+call.  Entries older than TTL_SECONDS are looked up again.
+
+Both kinds of client used in this repo can fill the cache: pass
+fetch_with_session(session) for a requests session (the Chat scripts) or
+fetch_with_service(people_service) for a googleapiclient People service.
+"""
+
+import threading
+import time
+
+import json_files
+import rate_limits
+
+CACHE_FILE = "identity_cache.json"
+TTL_SECONDS = 7 * 24 * 60 * 60  # one week
+
+# people.getBatchGet accepts up to 200 resource names per call
+PEOPLE_PER_BATCH_GET = 200
+PERSON_FIELDS = "names,emailAddresses"
+BATCH_GET_URL = "https://people.googleapis.com/v1/people:batchGet"
+
+# resource name -> {"fetched": seconds since the epoch, "person": person}
+_entries = None
+_lock = threading.RLock()
+
+
+def resource_name(person_id):
+    """people/ID for a bare ID, a people/ID or a Chat users/ID."""
+    return f"people/{person_id.split('/')[-1]}"
+
+
+def _load(path=CACHE_FILE):
+    global _entries
+    if _entries is None:
+        _entries = json_files.read_json(path) or {}
+    return _entries
+
+
+def _save(path=CACHE_FILE):
+    json_files.write_json(path, _entries)
+
+
+def clear():
+    """Forget every cached identity, on disk and in memory."""
+    global _entries
+    with _lock:
+        _entries = {}
+        _save()
+
+
+def fetch_with_session(session):
+    """A fetcher for get_people that calls People getBatchGet through a requests session."""
+
+    def fetch(resource_names):
+        resp = rate_limits.send(
+            session,
+            "GET",
+            BATCH_GET_URL,
+            "people",
+            params={"resourceNames": resource_names, "personFields": PERSON_FIELDS},
+        )
+        if resp.status_code != 200:
+            print(f"⚠️ Failed to get {len(resource_names)} people: {resp.text}")
+            return {}
+        return _people_from_batch_get(resp.json())
+
+    return fetch
+
+
+def fetch_with_service(people_service):
+    """A fetcher for get_people that calls People getBatchGet through a googleapiclient service."""
+
+    def fetch(resource_names):
+        response = rate_limits.execute(
+            people_service.people().getBatchGet(
+                resourceNames=resource_names, personFields=PERSON_FIELDS
+            ),
+            "people",
+        )
+        return _people_from_batch_get(response)
+
+    return fetch
+
+
+def _people_from_batch_get(response):
+    return {
+        entry["requestedResourceName"]: entry["person"]
+        for entry in response.get("responses", [])
+        if "person" in entry
+    }
+
+
+def get_people(person_ids, fetch, ttl=TTL_SECONDS):
+    """
+    Return {person_id: person resource} for each of `person_ids`, with None
+    for anyone the People API could not find.  `fetch` is fetch_with_session()
+    or fetch_with_service().
+    """
+    now = time.time()
+    with _lock:
+        entries = _load()
+        missing = sorted(
+            {
+                resource_name(person_id)
+                for person_id in person_ids
+                if now - entries.get(resource_name(person_id), {}).get("fetched", 0)
+                > ttl
+            }
+        )
+
+    for start in range(0, len(missing), PEOPLE_PER_BATCH_GET):
+        chunk = missing[start : start + PEOPLE_PER_BATCH_GET]
+        people = fetch(chunk)
+        with _lock:
+            for name, person in people.items():
+                entries[name] = {"fetched": now, "person": person}
+            _save()
+
+    with _lock:
+        return {
+            person_id: entries.get(resource_name(person_id), {}).get("person")
+            for person_id in person_ids
+        }
+
+
+def get_person(person_id, fetch, ttl=TTL_SECONDS):
+    return get_people([person_id], fetch, ttl)[person_id]
@@ -0,0 +1,56 @@
+"""
+Crash-safe JSON and JSONL files for the state these scripts keep between runs.
+
+append_jsonl() flushes and fsyncs every line, and read_jsonl() skips a
+partial last line left by a crash mid-write; run_journal and
+chat_sent_messages keep their records this way.  write_json() writes to a
+temporary file first and renames it into place, so a crash never leaves half
+a file; identity_cache and chat_space_registry are saved this way.
+"""
+
+import json
+import os
+
+
+def read_jsonl(path):
+    """Yield every readable line of the JSONL file at `path` (nothing if it doesn't exist)."""
+    if not os.path.exists(path):
+        return
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                # A crash mid-write can leave a partial last line
+                print(f"Ignoring unreadable line in {path}: {line[:80]}")
+
+
+def append_jsonl(path, entry):
+    """Append `entry` to the JSONL file at `path`, on disk before returning."""
+    with open(path, "a") as f:
+        f.write(json.dumps(entry) + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def read_json(path):
+    """The JSON value in `path`, or None if it doesn't exist or can't be read."""
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, json.JSONDecodeError) as e:
+        print(f"Ignoring unreadable {path}: {e}")
+        return None
+
+
+def write_json(path, value):
+    """Replace `path` with `value` as JSON, all at once."""
+    temp_path = f"{path}.tmp"
+    with open(temp_path, "w") as f:
+        json.dump(value, f)
+    os.replace(temp_path, path)
@@ -16,12 +16,9 @@
 # The script is intended for educational purposes and should be used responsibly.
 
 
-SLEEP = 1.1  # seconds
-
 import csv
 import json
 import os
-import time
 import sys
 from pprint import pprint
 
@@ -30,6 +27,16 @@ from google.auth.transport.requests import Request
 import google.auth
 import requests
 import inspect
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import batch_mode
+import chat_message_store
+import chat_sent_messages
+import chat_space_registry
+import identity_cache
+import rate_limits
+import run_journal
 
 
 # --- Config ---
@@ -43,11 +50,61 @@ SCOPES = [
 ]
 
 STAFF_FILE = "staff.txt"
+# Keep the list of spaces here between runs (see chat_space_registry);
+# set to None to list the spaces again on every run
+SPACE_REGISTRY_FILE = "chat_spaces.json"
+
+# spaces.setup accepts up to 20 initial memberships
+SETUP_MAX_MEMBERSHIPS = 20
+
+# Number of spaces worked on at the same time; the work within one space
+# stays in order, and rate_limits keeps every thread within the quotas
+CHAT_CONCURRENCY = 8
+
 ACTIVITY_NAME = "CS5A S25 Wk4"
 
 
+_prompt_lock = threading.Lock()
+
+
 def press_return_to_continue():
-    input("Press Return to continue...")
+    # One prompt at a time, even when spaces are processed in parallel
+    with _prompt_lock:
+        input("Press Return to continue...")
+
+
+def run_for_each_space(work, keys, concurrency=CHAT_CONCURRENCY):
+    """
+    Call work(key) for every key (one per space) on a pool of `concurrency`
+    threads.  Each call runs start to finish in one thread, so the operations
+    on one space stay in order.  A failure in one space does not stop the
+    others; a report of every space's outcome is printed at the end.
+
+    Returns {key: None if it succeeded, else the exception}.
+    """
+    futures = {}
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for key in keys:
+            futures[key] = executor.submit(work, key)
+
+    outcomes = {}
+    for key, future in futures.items():
+        try:
+            future.result()
+            outcomes[key] = None
+        except (Exception, SystemExit) as e:
+            # SystemExit too, from helpers that still call sys.exit
+            outcomes[key] = e
+
+    failures = [key for key, outcome in outcomes.items() if outcome is not None]
+    print("*" * 40)
+    print(f"Processed {len(outcomes) - len(failures)} of {len(outcomes)} spaces.")
+    for key, outcome in outcomes.items():
+        if outcome is None:
+            print(f"  OK: {key}")
+        else:
+            print(f"  FAILED: {key}: {outcome!r}")
+    return outcomes
     
 def function_name():
     return inspect.stack()[1].function
@@ -142,8 +199,16 @@ def get_welcome_text_midterm(space_display_name, group_folders, group_name):
 
 
 def send_message(
-    session, space_name, group_display_name, group_folders, group_name, text
+    session,
+    space_name,
+    group_display_name,
+    group_folders,
+    group_name,
+    text,
+    message_id=None,
 ):
+    # With a message_id (see chat_sent_messages), sending the same message
+    # again never posts it twice.  Returns the message, or None on failure
     group_folder_url = group_folders[group_name]["folder_url"]
 
     print(f"Group folder URL: {group_folder_url}")
@@ -152,65 +217,52 @@ def send_message(
     message_url = f"https://chat.googleapis.com/v1/{space_name}/messages"
 
     text_payload = {"text": text}
-
-    resp = session.post(message_url, json=text_payload)
+    params = {"messageId": message_id, "requestId": message_id} if message_id else {}
+
+    rate_limits.acquire("chat_space", space_name)
+    # With a requestId, Chat returns the original message for a repeat
+    resp = rate_limits.send(
+        session,
+        "POST",
+        message_url,
+        "chat",
+        idempotent=bool(message_id),
+        json=text_payload,
+        params=params,
+    )
+    if resp.status_code == 409 and message_id:
+        # A message with this messageId was already posted
+        print(f"✅ Welcome message already in {group_display_name}")
+        return {"name": f"{space_name}/messages/{message_id}"}
     if resp.status_code != 200:
         print(f"⚠️ Failed to send welcome message to {group_display_name}: {resp.text}")
-    else:
-        print(f"✅ Sent welcome message to {group_display_name}")
+        return None
+    print(f"✅ Sent welcome message to {group_display_name}")
+    return resp.json()
 
 
 def get_existing_space(session, display_name):
     print(f"Display name: {display_name}")
-    existing_spaces = get_existing_spaces(session)
-    for space in existing_spaces:
-        if space.get("displayName") == display_name:
-            return space
-    return None
+    return chat_space_registry.find_by_display_name(session, display_name)
 
 
 def list_all_spaces_with_display_names(session: requests.Session):
-    list_url = "https://chat.googleapis.com/v1/spaces"
-    params = {"pageSize": 100}
-
-    all_spaces = []
-
-    while True:
-        response = session.get(list_url, params=params)
-        if response.status_code != 200:
-            print(f"⚠️ Failed to list spaces: {response.status_code} {response.text}")
-            break
-
-        data = response.json()
-        all_spaces.extend(data.get("spaces", []))
-
-        if "nextPageToken" in data:
-            params["pageToken"] = data["nextPageToken"]
-        else:
-            break
-
-    return all_spaces
+    return chat_space_registry.list_all_spaces(session)
 
 
 def get_existing_spaces(session):
-    """Fetch and cache all existing spaces."""
-    if not hasattr(get_existing_spaces, "_cache"):
-        get_existing_spaces._cache = None
-
-    if get_existing_spaces._cache is not None:
-        return get_existing_spaces._cache
-
-    all_spaces = list_all_spaces_with_display_names(session)
-
-    get_existing_spaces._cache = all_spaces
-    return all_spaces
+    """Fetch (once) all existing spaces."""
+    return chat_space_registry.all_spaces(session)
 
 
 def create_new_space(session, space_display_name):
-    time.sleep(SLEEP)  # Respect rate limits
     create_space_payload = {"spaceType": "SPACE", "displayName": space_display_name}
-    resp = session.post(
-        "https://chat.googleapis.com/v1/spaces", json=create_space_payload
+    resp = rate_limits.send(
+        session,
+        "POST",
+        "https://chat.googleapis.com/v1/spaces",
+        "chat",
+        json=create_space_payload,
     )
     if resp.status_code != 200:
         print(f"❌ Failed to create space {space_display_name}: {resp.text}")
@@ -219,22 +271,58 @@ def create_new_space(session, space_display_name):
     space = resp.json()
     space_name = space["name"]
     print(f"🚀 Created space {space_display_name}: {space_name}")
+    chat_space_registry.add_space(space)
+    return space
+
+
+def create_new_space_with_members(session, space_display_name, emails):
+    # Create the space and add the first SETUP_MAX_MEMBERSHIPS members in a
+    # single spaces.setup call; returns the space, or None
+    setup_payload = {
+        "space": {"spaceType": "SPACE", "displayName": space_display_name},
+        "memberships": [
+            {"member": {"name": f"users/{email}", "type": "HUMAN"}}
+            for email in emails[:SETUP_MAX_MEMBERSHIPS]
+        ],
+    }
+    resp = rate_limits.send(
+        session,
+        "POST",
+        "https://chat.googleapis.com/v1/spaces:setup",
+        "chat",
+        json=setup_payload,
+    )
+    if resp.status_code != 200:
+        print(f"❌ Failed to set up space {space_display_name}: {resp.text}")
+        return None
+
+    space = resp.json()
+    print(
+        f"🚀 Created space {space_display_name}: {space['name']} with {len(setup_payload['memberships'])} members"
+    )
+    chat_space_registry.add_space(space)
     return space
 
 
 def get_person(session, user_id):
     # print(f"{function_name()}, called by {called_by()} Getting person {user_id}")
-    people_url = f"https://people.googleapis.com/v1/people/{user_id}?personFields=emailAddresses,names"
-    resp = session.get(people_url)
-    time.sleep(SLEEP)  # Respect rate limits
-    if resp.status_code != 200:
-        print(f"⚠️ Failed to get person {user_id}: {resp.text}")
+    person = identity_cache.get_person(
+        user_id, identity_cache.fetch_with_session(session)
+    )
+    if not person:
+        print(f"⚠️ Failed to get person {user_id}")
         sys.exit(1)
         return None
-    person = resp.json()
     return person
 
 
+def get_people(session, user_ids):
+    # Look up everyone in `user_ids` at once: {user_id: person or None}
+    return identity_cache.get_people(
+        user_ids, identity_cache.fetch_with_session(session)
+    )
+
+
 def person_to_name(person):
     if not person:
         return None
@@ -256,7 +344,7 @@ def person_to_ucsb_email(person):
 
 
 def person_id_to_ucsb_email(session, person_id):
-    person = get_person(session, person_id)
+    person = get_people(session, [person_id])[person_id]
     if not person:
         return None
     return person_to_ucsb_email(person)
@@ -271,7 +359,7 @@ def person_id_to_name(session, person_id):
 
 def get_existing_members_emails(session, space):
     members_url = f"https://chat.googleapis.com/v1/{space['name']}/members"
-    members_resp = session.get(members_url)
+    members_resp = rate_limits.send(session, "GET", members_url, "chat")
     if members_resp.status_code != 200:
         print(
             f"⚠️ Failed to get members for {space['displayName']}: {members_resp.text}"
@@ -287,10 +375,11 @@ def get_existing_members_emails(session, space):
         if user_id:
             user_ids.append(user_id)
 
-    # Use People API to fetch emails for the user IDs
+    # Use People API to fetch emails for the user IDs, all at once
+    people = get_people(session, user_ids)
     emails = []
     for user_id in user_ids:
-        email_entry = person_id_to_ucsb_email(session, user_id)
+        email_entry = person_to_ucsb_email(people[user_id])
         if email_entry:
             emails.append(email_entry)
 
@@ -356,15 +445,12 @@ def add_group_chat_urls_to_group_folder(session, group_folders, ACTIVITY_NAME):
 
 
 def get_recent_messages(session, space):
-    messages_url = f"https://chat.googleapis.com/v1/{space['name']}/messages"
-    params = {"pageSize": 50, "orderBy": "createTime asc"}
-    resp = session.get(messages_url, params=params)
-    if resp.status_code != 200:
-        print(
-            f"⚠️ Failed to get recent messages for {space['displayName']}: {resp.text}"
-        )
+    # Fetch whatever is new since the last run into chat_message_store,
+    # then return every message in the space from the store, oldest first
+    if chat_message_store.sync_space(session, space["name"]) is None:
+        print(f"⚠️ Failed to get recent messages for {space['displayName']}")
         return None
-    messages = resp.json().get("messages", [])
+    messages = chat_message_store.get_messages(space["name"])
 
     # Add the URL of each message to the message data
     for message in messages:
@@ -397,6 +483,8 @@ def get_session():
     creds = authenticate()
     session = requests.Session()
     session.headers.update({"Authorization": f"Bearer {creds.token}"})
+    if SPACE_REGISTRY_FILE:
+        chat_space_registry.open_registry(session, SPACE_REGISTRY_FILE)
     return session
 
 
@@ -412,28 +500,35 @@ def get_group_to_list_of_emails_dict(STUDENT_CSV):
     return group_to_list_of_emails
 
 
-def send_message_unless_sent_recently(session, space, group_folders, group_name, text):
-
-    recent_messages = get_recent_messages(session, space)
-
-    sent = False
-    for message in recent_messages:
-        if message.get("text") == text:
-            print(f"✅ Message already sent to {space['displayName']}.")
-            sent = True
-            break
-
-        if not sent:
-            print(f"🔄 Sending welcome message to {space['displayName']}...")
-            send_message(
-                session,
-                space["name"],
-                space["displayName"],
-                group_folders,
-                group_name,
-                text,
-            )
-            time.sleep(SLEEP)  # Respect rate limits
+def send_message_unless_sent_recently(
+    session, space, group_folders, group_name, text, template=None
+):
+    # Send `text` once per (space, template, group).  The ledger in
+    # chat_sent_messages says whether it was already delivered, without
+    # reading any messages; the client-assigned message ID makes a resend
+    # after a crash harmless.  `template` defaults to the text itself.
+    if template is None:
+        template = text
+    message_id = chat_sent_messages.message_id(space["name"], template, group_name)
+    if chat_sent_messages.is_sent(message_id):
+        print(f"✅ Message already sent to {space['displayName']}.")
+        return
+
+    print(f"🔄 Sending welcome message to {space['displayName']}...")
+    message = send_message(
+        session,
+        space["name"],
+        space["displayName"],
+        group_folders,
+        group_name,
+        text,
+        message_id,
+    )
+    if not message:
+        raise Exception(f"Failed to send welcome message to {space['displayName']}")
+    chat_sent_messages.record_sent(
+        message_id, space["name"], template, group_name, message.get("name")
+    )
 
 
 def welcome_text_function_week4(session, space, group_folders, group_name):
@@ -441,7 +536,7 @@ def welcome_text_function_week4(session, space, group_folders, group_name):
         space["displayName"], group_folders, group_name
     )
     send_message_unless_sent_recently(
-        session, space, group_folders, group_name, welcome_text
+        session, space, group_folders, group_name, welcome_text, "welcome_week4"
     )
 
 
@@ -450,18 +545,32 @@ def welcome_text_function_midterm(session, space, group_folders, group_name):
         space["displayName"], group_folders, group_name
     )
     send_message_unless_sent_recently(
-        session, space, group_folders, group_name, welcome_text
+        session, space, group_folders, group_name, welcome_text, "welcome_midterm"
     )
 
 
 # --- Main Script ---
 def create_group_chats(
-    session, group_folders, STUDENT_CSV, ACTIVITY_NAME, welcome_text_function=None
+    session,
+    group_folders,
+    STUDENT_CSV,
+    ACTIVITY_NAME,
+    welcome_text_function=None,
+    run_id=None,
+    concurrency=CHAT_CONCURRENCY,
+    limits=None,
+    assume_yes=None,
 ):
 
     # Reads group_export_nnnnn.csv
     # Creates a dictionary `groups` with key as group_name, and values as a list of student emails
 
+    # Completed steps (space created, member invited) are recorded
+    # in run_journal, so a rerun with the same run_id resumes where it stopped
+    if run_id is None:
+        run_id = ACTIVITY_NAME
+    journal = run_journal.open_journal(run_id, STUDENT_CSV)
+
     # Read students
     group_to_list_of_emails = get_group_to_list_of_emails_dict(STUDENT_CSV)
 
@@ -473,7 +582,8 @@ def create_group_chats(
 
     group_names.sort(key=folder_name_sort_key)
 
-    # Process each group
+    # Choose the groups to process
+    selected_groups = []
     for group_name in group_names:
         if group_name == "":
             continue
@@ -492,63 +602,169 @@ def create_group_chats(
             print(f"⚠️ Invalid group name format: {group_name}")
             continue
 
-        student_emails = group_to_list_of_emails[group_name]
-        space_display_name = get_space_name_from_group_name(group_name, ACTIVITY_NAME)
-        print(f"🔄 {function_name()} Processing group: {space_display_name}")
-
-        # Check if space already exists
-        search_url = "https://chat.googleapis.com/v1/spaces"
+        selected_groups.append(group_name)
 
-        space = get_existing_space(session, space_display_name)
+    # Batch mode: list every space, invite and welcome message first, and get
+    # a single approval (or --yes) instead of pausing before each one.
+    # `limits`, e.g. {"create space": 10}, stops the run before it starts if
+    # more changes than that are planned.
+    # The reads behind the plan (each space's existing members) run several
+    # spaces at a time, like the changes themselves.
+    known_members = {}
+    planned = {}
 
-        if space:
-            print(f"✅ Space {space_display_name} already exists.")
+    def plan_chat(group_name):
+        space_display_name = get_space_name_from_group_name(group_name, ACTIVITY_NAME)
+        if run_journal.step_done(journal, group_name, "space"):
+            space = run_journal.step_result(journal, group_name, "space")
         else:
-            # Create space
-            print(f"🚀 Creating space {space_display_name}...")
-            press_return_to_continue()
-            space = create_new_space(session, space_display_name)
-            if not space:
-                print(f"❌ Failed to create space {space_display_name}.")
-                sys.exit(0)
+            space = get_existing_space(session, space_display_name)
+        emails_to_invite = [
+            email
+            for email in group_to_list_of_emails[group_name]
+            if not run_journal.step_done(journal, group_name, f"invite {email}")
+        ]
+        if not space:
+            emails_to_invite = emails_to_invite[SETUP_MAX_MEMBERSHIPS:]
+        elif emails_to_invite:
+            known_members[group_name] = get_existing_members_emails(session, space)
+            emails_to_invite = [
+                email
+                for email in emails_to_invite
+                if email not in (known_members[group_name] or [])
+            ]
+        planned[group_name] = (space_display_name, space, emails_to_invite)
+
+    planning_outcomes = run_for_each_space(plan_chat, selected_groups, concurrency)
+    # A space whose planning reads failed is left out of this run
+    selected_groups = [
+        group_name
+        for group_name in selected_groups
+        if planning_outcomes[group_name] is None
+    ]
+
+    plan = batch_mode.new_plan(f"Group chats for {ACTIVITY_NAME}")
+    for group_name in selected_groups:
+        space_display_name, space, emails_to_invite = planned[group_name]
+        if not space:
+            batch_mode.add(plan, "create space", space_display_name)
+        for email in emails_to_invite:
+            batch_mode.add(plan, "invite member", f"{email} to {space_display_name}")
+        if welcome_text_function:
+            # Skipped when it runs if the chat_sent_messages ledger has it
+            batch_mode.add(plan, "send welcome message", space_display_name)
+    if not batch_mode.approve(plan, limits, assume_yes):
+        print("Cancelled; nothing was changed.")
+        return {}
 
-        # Get existing members
-        existing_members_list = get_existing_members_emails(session, space)
-        print(f"Existing members: {existing_members_list}")
+    def provision_chat(group_name):
+        student_emails = group_to_list_of_emails[group_name]
+        space_display_name = get_space_name_from_group_name(group_name, ACTIVITY_NAME)
+        print(f"🔄 {function_name()} Processing group: {space_display_name}")
 
         # Invite members
         # all_emails = student_emails + staff_emails
         all_emails = student_emails
 
-        for email in all_emails:
+        def find_or_create_space():
+            # Check if space already exists
+            space = get_existing_space(session, space_display_name)
+
+            if space:
+                print(f"✅ Space {space_display_name} already exists.")
+                members = []
+            else:
+                # Create space, with its members, in one spaces.setup call
+                print(f"🚀 Creating space {space_display_name}...")
+                members = all_emails[:SETUP_MAX_MEMBERSHIPS]
+                space = create_new_space_with_members(
+                    session, space_display_name, members
+                )
+                if not space:
+                    raise Exception(f"Failed to create space {space_display_name}.")
+            return {
+                "name": space["name"],
+                "displayName": space["displayName"],
+                "members": members,
+            }
+
+        space = run_journal.run_step(journal, group_name, "space", find_or_create_space)
+
+        # Members added by spaces.setup don't need inviting again
+        for email in space.get("members", []):
+            if not run_journal.step_done(journal, group_name, f"invite {email}"):
+                run_journal.record_step(journal, group_name, f"invite {email}")
+
+        emails_to_invite = [
+            email
+            for email in all_emails
+            if not run_journal.step_done(journal, group_name, f"invite {email}")
+        ]
+        failed_invites = []
+        if emails_to_invite:
+            # Get existing members, unless the plan already did
+            existing_members_list = known_members.get(group_name)
+            if existing_members_list is None:
+                existing_members_list = get_existing_members_emails(session, space)
+            print(f"Existing members: {existing_members_list}")
+
+        for email in emails_to_invite:
             if email in existing_members_list:
                 print(f"✅ {email} already in {space_display_name}.")
+                run_journal.record_step(journal, group_name, f"invite {email}")
                 continue
             print(f"🔄 Inviting {email} to {space_display_name}...")
-            press_return_to_continue()
             member_payload = {"member": {"name": f"users/{email}", "type": "HUMAN"}}
             invite_url = f"https://chat.googleapis.com/v1/{space['name']}/members"
-            r = session.post(invite_url, json=member_payload)
+            rate_limits.acquire("chat_space", space["name"])
+            r = rate_limits.send(session, "POST", invite_url, "chat", json=member_payload)
 
             if r.status_code != 200:
                 print(f"⚠️ Failed to add {email} to {space['displayName']}: {r.text}")
+                failed_invites.append(email)
             else:
                 print(f"➕ Added {email} to {space['displayName']}")
+                run_journal.record_step(journal, group_name, f"invite {email}")
 
-            time.sleep(SLEEP)  # Respect rate limits
-
-        # Send a welcome card unless we've already sent one
+        # Send a welcome card unless we've already sent one; the
+        # chat_sent_messages ledger records only messages that were delivered
 
         if welcome_text_function:
             welcome_text_function(session, space, group_folders, group_name)
 
-    print("✅ All groups processed successfully.")
+        if failed_invites:
+            raise Exception(f"Failed to add {failed_invites} to {space_display_name}")
+
+    # Process the groups, several spaces at a time
+    outcomes = run_for_each_space(provision_chat, selected_groups, concurrency)
+    return outcomes
+
+
+def send_welcome_texts(
+    session, group_folders, welcome_text_function, concurrency=CHAT_CONCURRENCY
+):
+    """Call welcome_text_function for every group's space, several spaces at a time."""
+
+    def send_welcome_text(group_name):
+        space = get_space_from_space_name(
+            session, group_folders[group_name]["space_name"]
+        )
+        if not space:
+            raise Exception(f"Space for {group_name} not found.")
+        welcome_text_function(session, space, group_folders, group_name)
+
+    group_names = [name for name in group_folders if name != ""]
+    group_names.sort(key=folder_name_sort_key)
+    return run_for_each_space(send_welcome_text, group_names, concurrency)
 
 
 def get_space_from_space_name(session, space_name):
     """Fetch space details from space name."""
+    space = chat_space_registry.find_by_name(session, space_name)
+    if space:
+        return space
     space_url = f"https://chat.googleapis.com/v1/{space_name}"
-    resp = session.get(space_url)
+    resp = rate_limits.send(session, "GET", space_url, "chat")
     if resp.status_code != 200:
         print(f"⚠️ Failed to get space {space_name}: {resp.text}")
         return None
@@ -574,9 +790,13 @@ def read_chat_messages(session, group_folders, process_messages_for_this_group=N
         print(f"Reading messages from {space_name}...")
         messages = get_recent_messages(session, space)
         if messages:
+            senders = get_people(
+                session,
+                [message["sender"]["name"].split("/")[-1] for message in messages],
+            )
             for message in messages:
                 user_id = message["sender"]["name"].split("/")[-1]
-                person = get_person(session, user_id)
+                person = senders[user_id]
                 if not person:
                     print(f"⚠️ Failed to get person {user_id}: {person}")
                     sys.exit(1)
@@ -593,8 +813,7 @@ def read_chat_messages(session, group_folders, process_messages_for_this_group=N
                 result.append(this_message)
                 this_groups_messages.append(this_message)
         if process_messages_for_this_group:
-            process_messages_for_this_group(group_name, this_groups_messsages)
-        time.sleep(SLEEP)  # Respect rate limits
+            process_messages_for_this_group(group_name, this_groups_messages)
     return result
 
 
@@ -611,9 +830,13 @@ def read_chat_messages_given_groups(session, groups):
         print(f"Reading messages from {space_name}...")
         messages = get_recent_messages(session, space)
         if messages:
+            senders = get_people(
+                session,
+                [message["sender"]["name"].split("/")[-1] for message in messages],
+            )
             for message in messages:
                 user_id = message["sender"]["name"].split("/")[-1]
-                person = get_person(session, user_id)
+                person = senders[user_id]
                 if not person:
                     print(f"⚠️ Failed to get person {user_id}: {person}")
                     sys.exit(1)
@@ -629,7 +852,6 @@ def read_chat_messages_given_groups(session, groups):
                 }
                 result.append(this_message)
                 this_groups_messages.append(this_message)
-        time.sleep(SLEEP)  # Respect rate limits
     return result
 
 def print_chat_message_data(chat_message_data):
@@ -682,16 +904,16 @@ def write_group_folders_with_chat_groups(group_folders, GROUP_CATEGORY_ID):
     print(f"✅ Group folders written to {output_file}")
 
 
-def invite_staff_to_group_chats(session, group_folders, SECTION_TO_STAFF_EMAILS):
+def invite_staff_to_group_chats(
+    session, group_folders, SECTION_TO_STAFF_EMAILS, concurrency=CHAT_CONCURRENCY
+):
 
     group_names = list(group_folders.keys())
     group_names.sort(key=folder_name_sort_key)
 
     print(f"Groups names: {group_names}")
 
-    for group_name in group_names:
-        if group_name == "":
-            continue
+    def invite_staff(group_name):
         print(f"{function_name()}: Group name: {group_name}")
         data = group_folders[group_name]
         space_name = data["space_name"]
@@ -703,13 +925,18 @@ def invite_staff_to_group_chats(session, group_folders, SECTION_TO_STAFF_EMAILS)
         section = parts[-1]
         print(f"Section: {section}")
         space = get_existing_space(session, space_display_name)
+        if not space:
+            raise Exception(f"Space {space_display_name} not found.")
 
         # Invite staff members
         staff_emails = SECTION_TO_STAFF_EMAILS[section]
 
         # Get existing members
         existing_members_list = get_existing_members_emails(session, space)
+        if existing_members_list is None:
+            raise Exception(f"Failed to get members of {space_display_name}.")
 
+        failed_invites = []
         for email in staff_emails:
             print(f"About to invite {email} to {space_display_name}...")
             if email in existing_members_list:
@@ -718,16 +945,24 @@ def invite_staff_to_group_chats(session, group_folders, SECTION_TO_STAFF_EMAILS)
             print(f"🔄 Inviting {email} to {space_display_name}...")
             member_payload = {"member": {"name": f"users/{email}", "type": "HUMAN"}}
             invite_url = f"https://chat.googleapis.com/v1/{space_name}/members"
-            r = session.post(invite_url, json=member_payload)
+            rate_limits.acquire("chat_space", space_name)
+            r = rate_limits.send(session, "POST", invite_url, "chat", json=member_payload)
 
             if r.status_code != 200:
                 print(f"⚠️ Failed to add {email} to {space_display_name}: {r.text}")
+                failed_invites.append(email)
             else:
                 print(f"➕ Added {email} to {space_display_name}")
 
-            time.sleep(SLEEP)  # Respect rate limits
+        if failed_invites:
+            raise Exception(f"Failed to add {failed_invites} to {space_display_name}")
 
-    print("✅ All staff processed successfully.")
+    # Process the groups, several spaces at a time
+    outcomes = run_for_each_space(
+        invite_staff, [name for name in group_names if name != ""], concurrency
+    )
+    print("✅ All staff processed.")
+    return outcomes
 
 
 if __name__ == "__main__":
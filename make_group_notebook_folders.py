@@ -1,24 +1,36 @@
 import os
 import json
 import csv
+import re
 import string
 from xmlrpc.client import boolean
 from google.oauth2.credentials import Credentials
 from google.auth.transport.requests import Request
 from google_auth_oauthlib.flow import InstalledAppFlow
-from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
 from googleapiclient.http import MediaFileUpload
 import pickle
 from pprint import pprint
-import time
-import sys
+from concurrent.futures import ThreadPoolExecutor
 
 
+import artifact_stamps
 import canvas_roster_functions
+import drive_activity
+import drive_batch_functions
+import drive_folder_index
+import drive_listing
+import drive_metadata_cache
+import google_services
+import rate_limits
+import run_journal
 import make_google_chat_conversations
 
-SLEEP_TIME = 1
+# Keep Drive metadata in drive_metadata_cache.CACHE_FILE between runs
+USE_METADATA_CACHE = True
+
+# Number of groups provisioned at the same time by make_group_folders_with_retro
+PROVISIONING_CONCURRENCY = 8
 
 # Define the required scopes
 SCOPES = [
@@ -45,23 +57,18 @@ def authenticate():
             creds = flow.run_local_server(port=0)
         with open("token.json", "w") as token:
             token.write(creds.to_json())
-    return build("drive", "v3", credentials=creds)
+    service = google_services.get_service("drive", "v3", creds)
+    if USE_METADATA_CACHE:
+        drive_metadata_cache.open_cache(service)
+    return service
 
 
 # Create a folder and return its ID
 def create_folder(service, name, parent_id=None, create_if_not_exists=True):
-    query = f"name='{name}' and mimeType='application/vnd.google-apps.folder'"
-    if parent_id:
-        query += f" and '{parent_id}' in parents"
-    results = (
-        service.files()
-        .list(q=query, spaces="drive", fields="files(id, name)")
-        .execute()
-    )
-    folders = results.get("files", [])
+    folder = find_folder(service, name, parent_id)
     # If the folder already exists, return its ID
-    if folders:
-        return folders[0]["id"]
+    if folder:
+        return folder["id"]
 
     if not create_if_not_exists:
         print(
@@ -75,7 +82,13 @@ def create_folder(service, name, parent_id=None, create_if_not_exists=True):
         "mimeType": "application/vnd.google-apps.folder",
         "parents": [parent_id] if parent_id else [],
     }
-    folder = service.files().create(body=metadata, fields="id").execute()
+    folder = rate_limits.execute(
+        service.files().create(body=metadata, fields="id, name, mimeType"), "drive"
+    )
+    if parent_id:
+        drive_folder_index.add_file(parent_id, folder)
+    else:
+        drive_folder_index.add_top_level_folder(folder)
     return folder["id"]
 
 
@@ -88,15 +101,36 @@ def share_folder(service, file_id, email):
     # Create a permission object
     permission = {"type": "user", "role": "writer", "emailAddress": email}
     # Create the permission using the Drive API
-    service.permissions().create(
-        fileId=file_id, body=permission, fields="id", sendNotificationEmail=False
-    ).execute()
+    rate_limits.execute(
+        service.permissions().create(
+            fileId=file_id, body=permission, fields="id", sendNotificationEmail=False
+        ),
+        "drive",
+    )
+
+
+def share_folder_with_members(service, file_id, emails):
+    # Give every email address in `emails` write access to the folder
+    # using a single batch request instead of one request per email.
+    # Returns (results, errors), both keyed by email address.
+    keys = {f"share {file_id} {email}": email for email in emails}
+    requests = {
+        key: drive_batch_functions.share_folder_request(service, file_id, email)
+        for key, email in keys.items()
+    }
+    results, errors = drive_batch_functions.execute_batch(service, requests)
+    return (
+        {keys[key]: result for key, result in results.items()},
+        {keys[key]: error for key, error in errors.items()},
+    )
 
 
 def get_values_from_spreadsheet(service, sheet_id):
     # Find a tab in the spreadsheet called "Members"
-    sheets_service = build("sheets", "v4", credentials=service._http.credentials)
-    result = sheets_service.spreadsheets().get(spreadsheetId=sheet_id).execute()
+    sheets_service = google_services.get_service_like(service, "sheets", "v4")
+    result = rate_limits.execute(
+        sheets_service.spreadsheets().get(spreadsheetId=sheet_id), "sheets"
+    )
     sheets = result.get("sheets", [])
     members_tab = None
     for sheet in sheets:
@@ -108,11 +142,11 @@ def get_values_from_spreadsheet(service, sheet_id):
 
     # Get the values from the "Members" tab
     range_name = f"'{members_tab['properties']['title']}'!A1:B"
-    result = (
+    result = rate_limits.execute(
         sheets_service.spreadsheets()
         .values()
-        .get(spreadsheetId=sheet_id, range=range_name)
-        .execute()
+        .get(spreadsheetId=sheet_id, range=range_name),
+        "sheets",
     )
     values = result.get("values", [])
     return values
@@ -131,7 +165,9 @@ def create_new_retro_file_google_doc(
         "mimeType": "application/vnd.google-apps.document",
         "parents": [group_drive_folder_id],
     }
-    doc = service.files().create(body=doc_metadata, fields="id").execute()
+    doc = rate_limits.execute(
+        service.files().create(body=doc_metadata, fields="id"), "drive"
+    )
     return doc
 
 
@@ -148,59 +184,75 @@ def get_all_tab_titles(tabs):
 
 
 def get_document_from_document_id(service, document_id):
-    docs_service = build("docs", "v1", credentials=service._http.credentials)
-    document = (
-        docs_service.documents()
-        .get(documentId=document_id, includeTabsContent=True)
-        .execute()
+    docs_service = google_services.get_service_like(service, "docs", "v1")
+    document = rate_limits.execute(
+        docs_service.documents().get(documentId=document_id, includeTabsContent=True),
+        "docs",
     )
     return document
 
 
-def rename_tabs_for_each_member(service, doc, group_name, members):
+def get_member_tab_ids(document):
     """
-    Add a new tab to the Google Doc for each member.
+    Map each 'MemberN' tab title in the document to its tab ID.
+    Copies of a document keep the tab IDs of the original, so the map
+    computed from the template can be used for every copy.
     """
+    member_tab_ids = {}
+    for tab in document.get("tabs", []):
+        tab_title = get_tab_name(tab)
+        if tab_title and tab_title.startswith("Member"):
+            member_tab_ids[tab_title] = tab["tabProperties"]["tabId"]
+    return member_tab_ids
 
-    requests = []
 
-    orig_tab_name_to_new_tab_name = {}
+def rename_member_tabs_requests(member_tab_ids, members):
+    requests = []
     for i, member in enumerate(members):
-        member_name = member["student_name"]
         orig_tab_name = f"Member{i+1}"
-        orig_tab_name_to_new_tab_name[orig_tab_name] = member_name
+        if orig_tab_name not in member_tab_ids:
+            continue
+        new_tab_name = member["student_name"]
+        print(f"Renaming tab '{orig_tab_name}' to '{new_tab_name}'...")
+        requests.append(
+            {
+                "updateDocumentTabProperties": {
+                    "tabProperties": {
+                        "tabId": member_tab_ids[orig_tab_name],
+                        "title": new_tab_name,
+                    },
+                    "fields": "title",
+                }
+            }
+        )
+    return requests
+
+
+def rename_tabs_for_each_member(service, doc, group_name, members):
+    """
+    Rename the Member tabs of the Google Doc to the members' names, using one
+    batchUpdate built by rename_member_tabs_requests.
+    """
 
     # Initialize the Docs API service
-    docs_service = build("docs", "v1", credentials=service._http.credentials)
+    docs_service = google_services.get_service_like(service, "docs", "v1")
     document = get_document_from_document_id(service, doc["id"])
 
     # 2. Get flat list of existing tab names
-    existing_tabs = document.get("tabs", [])
-    existing_titles = get_all_tab_titles(existing_tabs)
+    existing_titles = get_all_tab_titles(document.get("tabs", []))
 
     print(f"Existing tabs in document '{group_name}': {existing_titles}")
 
-    for tab in existing_tabs:
-        tab_title = get_tab_name(tab)
-        if tab_title in orig_tab_name_to_new_tab_name:
-            new_tab_name = orig_tab_name_to_new_tab_name[tab_title]
-            print(f"Renaming tab '{tab_title}' to '{new_tab_name}'...")
-            tabId = tab["tabProperties"]["tabId"]
-            print("Tab ID: ", tabId)
-            requests.append(
-                {
-                    "updateDocumentTabProperties": {
-                        "tabProperties": {"tabId": tabId, "title": new_tab_name},
-                        "fields": "title",
-                    }
-                }
-            )
+    requests = rename_member_tabs_requests(get_member_tab_ids(document), members)
 
     # 4. Execute the update if there are new tabs to add
     if requests:
-        docs_service.documents().batchUpdate(
-            documentId=doc["id"], body={"requests": requests}
-        ).execute()
+        rate_limits.execute(
+            docs_service.documents().batchUpdate(
+                documentId=doc["id"], body={"requests": requests}
+            ),
+            "docs",
+        )
         print(f"Successfully added {len(requests)} tabs to the document.")
     else:
         print("All member tabs already exist.")
@@ -215,18 +267,17 @@ def locate_retro_file_template(service, parent_folder_id, retro_file_name="Retro
         )
     print(f"Located TEMPLATES folder in parent folder {parent_folder_id}.")
     # Locate a file with the name retro_file_name in the TEMPLATES folder
-    query = f"name='{retro_file_name}' and mimeType='application/vnd.google-apps.document' and '{templates_folder['id']}' in parents"
-    results = (
-        service.files()
-        .list(q=query, spaces="drive", fields="files(id, name)")
-        .execute()
+    template = drive_folder_index.find_child(
+        service,
+        templates_folder["id"],
+        retro_file_name,
+        "application/vnd.google-apps.document",
     )
-    templates = results.get("files", [])
-    if not templates:
+    if not template:
         raise Exception(
             f"Template file '{retro_file_name}' not found in TEMPLATES folder."
         )
-    return templates[0]
+    return template
 
 
 def get_tab_name(tab):
@@ -237,18 +288,23 @@ def create_or_update_member_file_google_sheet(
     service, group_drive_folder_id, group_name, members
 ):
     # Check if a Google Sheet with the target name already exists
-    query = f"name='{group_name}_members' and mimeType='application/vnd.google-apps.spreadsheet' and '{group_drive_folder_id}' in parents"
-    results = (
-        service.files()
-        .list(q=query, spaces="drive", fields="files(id, name)")
-        .execute()
+    sheets = drive_folder_index.find_children(
+        service,
+        group_drive_folder_id,
+        f"{group_name}_members",
+        "application/vnd.google-apps.spreadsheet",
     )
-    sheets = results.get("files", [])
 
     if sheets:
-        valuesFromSheet = get_values_from_spreadsheet(service, sheets[0]["id"])
-        valuesToSheet = get_values_for_spreadsheet(members)
-        if valuesFromSheet != valuesToSheet:
+        # The stamp from the folder listing says whether the member list
+        # changed; only sheets made before stamping need their values read
+        inputs_hash = member_sheet_hash(members)
+        if artifact_stamps.get_stamp(sheets[0]) is not None:
+            up_to_date = artifact_stamps.is_fresh(sheets[0], inputs_hash)
+        else:
+            valuesFromSheet = get_values_from_spreadsheet(service, sheets[0]["id"])
+            up_to_date = valuesFromSheet == get_values_for_spreadsheet(members)
+        if not up_to_date:
             create_new_tab_member_file_google_sheet(
                 service, group_drive_folder_id, group_name, members, sheets
             )
@@ -260,46 +316,59 @@ def create_or_update_member_file_google_sheet(
         )
 
 
-def create_new_member_file_google_sheet(
-    service, group_drive_folder_id, group_name, members
-):
-    # If the spreadsheet does not exist, create a new one
-    sheet_metadata = {
-        "name": f"{group_name}_members",
-        "mimeType": "application/vnd.google-apps.spreadsheet",
-        "parents": [group_drive_folder_id],
-    }
-    sheet = service.files().create(body=sheet_metadata, fields="id").execute()
-    sheet_id = sheet["id"]
-
-    # Rename the default tab to "Members"
-    sheets_service = build("sheets", "v4", credentials=service._http.credentials)
-    rename_tab_body = {
-        "requests": [
+def create_member_spreadsheet(service, group_name, members):
+    """
+    Create the {group_name}_members spreadsheet, with its Members tab already
+    filled in, using a single Sheets spreadsheets.create call.  The new
+    spreadsheet is in the root of My Drive; returns its ID.
+    """
+    sheets_service = google_services.get_service_like(service, "sheets", "v4")
+    body = {
+        "properties": {"title": f"{group_name}_members"},
+        "sheets": [
             {
-                "updateSheetProperties": {
-                    "properties": {
-                        "sheetId": 0,  # Default sheet ID is 0
-                        "title": "Members",
-                    },
-                    "fields": "title",
-                }
+                "properties": {"sheetId": 0, "title": "Members"},
+                "data": [
+                    {
+                        "startRow": 0,
+                        "startColumn": 0,
+                        "rowData": get_row_data_for_spreadsheet(members),
+                    }
+                ],
             }
-        ]
+        ],
     }
-    sheets_service.spreadsheets().batchUpdate(
-        spreadsheetId=sheet_id, body=rename_tab_body
-    ).execute()
+    spreadsheet = rate_limits.execute(
+        sheets_service.spreadsheets().create(body=body, fields="spreadsheetId"),
+        "sheets",
+    )
+    return spreadsheet["spreadsheetId"]
 
-    # Prepare data for the Google Sheet
-    values = get_values_for_spreadsheet(members)
 
-    # Update the Google Sheet with the member data
-    body = {"values": values}
-    range_name = "Members!A1"
-    sheets_service.spreadsheets().values().update(
-        spreadsheetId=sheet_id, range=range_name, valueInputOption="RAW", body=body
-    ).execute()
+def create_new_member_file_google_sheet(
+    service, group_drive_folder_id, group_name, members
+):
+    # If the spreadsheet does not exist, create a new one
+    sheet_id = create_member_spreadsheet(service, group_name, members)
+
+    # Move it from the root of My Drive into the group folder, stamping it
+    # with the hash of the member list in the same update
+    app_properties = artifact_stamps.stamp(member_sheet_hash(members))
+    rate_limits.execute(
+        drive_batch_functions.move_file_request(
+            service, sheet_id, "root", group_drive_folder_id, app_properties
+        ),
+        "drive",
+    )
+    drive_folder_index.add_file(
+        group_drive_folder_id,
+        {
+            "id": sheet_id,
+            "name": f"{group_name}_members",
+            "mimeType": "application/vnd.google-apps.spreadsheet",
+            "appProperties": app_properties,
+        },
+    )
 
     print(
         f"Created new spreadsheet: {group_name}_members in group folder: {group_name}"
@@ -314,17 +383,36 @@ def get_values_for_spreadsheet(members):
     return values
 
 
+def member_sheet_hash(members):
+    # Hash of everything written into a members sheet, for artifact_stamps
+    return artifact_stamps.content_hash(
+        {"artifact": "members_sheet", "values": get_values_for_spreadsheet(members)}
+    )
+
+
+def get_row_data_for_spreadsheet(members):
+    # The same values as get_values_for_spreadsheet, in the RowData form
+    # used by spreadsheets.create and updateCells, entered as raw strings
+    return [
+        {"values": [{"userEnteredValue": {"stringValue": value}} for value in row]}
+        for row in get_values_for_spreadsheet(members)
+    ]
+
+
 def create_new_tab_member_file_google_sheet(
     service, group_drive_folder_id, group_name, members, sheets
 ):
     # If the spreadsheet exists, add a new tab with the member data
     sheet_id = sheets[0]["id"]
-    sheets_service = build("sheets", "v4", credentials=service._http.credentials)
-
-    new_tab_name = "Members"
+    sheets_service = google_services.get_service_like(service, "sheets", "v4")
 
     # Determine number of existing tabs
-    existing_tabs = sheets_service.spreadsheets().get(spreadsheetId=sheet_id).execute()
+    existing_tabs = rate_limits.execute(
+        sheets_service.spreadsheets().get(
+            spreadsheetId=sheet_id, fields="sheets.properties(sheetId,title)"
+        ),
+        "sheets",
+    )
     existing_tabs = existing_tabs.get("sheets", [])
     existing_tab_names = [tab["properties"]["title"] for tab in existing_tabs]
 
@@ -335,45 +423,60 @@ def create_new_tab_member_file_google_sheet(
         version += 1
         new_tab_name = f"Members_{version}"
 
-    # Create a new tab with a unique name
-    add_sheet_body = {
-        "requests": [{"addSheet": {"properties": {"title": new_tab_name}}}]
+    # Choose the new tab's ID ourselves, so the tab can be created and
+    # filled in with the member data in a single batchUpdate
+    new_tab_id = max(tab["properties"]["sheetId"] for tab in existing_tabs) + 1
+    body = {
+        "requests": [
+            {
+                "addSheet": {
+                    "properties": {"sheetId": new_tab_id, "title": new_tab_name}
+                }
+            },
+            {
+                "updateCells": {
+                    "start": {"sheetId": new_tab_id, "rowIndex": 0, "columnIndex": 0},
+                    "rows": get_row_data_for_spreadsheet(members),
+                    "fields": "userEnteredValue",
+                }
+            },
+        ]
     }
-    sheets_service.spreadsheets().batchUpdate(
-        spreadsheetId=sheet_id, body=add_sheet_body
-    ).execute()
-
-    # Prepare data for the new tab
-    values = get_values_for_spreadsheet(members)
-
-    # Update the new tab with the member data
-    body = {"values": values}
-    range_name = f"'{new_tab_name}'!A1"
-    sheets_service.spreadsheets().values().update(
-        spreadsheetId=sheet_id, range=range_name, valueInputOption="RAW", body=body
-    ).execute()
+    rate_limits.execute(
+        sheets_service.spreadsheets().batchUpdate(spreadsheetId=sheet_id, body=body),
+        "sheets",
+    )
+    stamp_file(service, sheet_id, member_sheet_hash(members))
 
     print(
         f"Updated existing spreadsheet: {group_name}_members with new tab: {new_tab_name}"
     )
 
 
+def stamp_file(service, file_id, inputs_hash):
+    # Record the hash of the inputs `file_id` was made from (see artifact_stamps)
+    app_properties = artifact_stamps.stamp(inputs_hash)
+    rate_limits.execute(
+        drive_batch_functions.stamp_file_request(service, file_id, app_properties),
+        "drive",
+    )
+    drive_folder_index.set_app_properties(file_id, app_properties)
+
+
 def update_retro_file_google_doc(
     service, group_drive_folder_id, group, members, retro_file_name
 ):
     # Get the file ID of the retro file in the group folder
-    query = f"name='{retro_file_name}' and mimeType='application/vnd.google-apps.document' and '{group_drive_folder_id}' in parents"
-    results = (
-        service.files()
-        .list(q=query, spaces="drive", fields="files(id, name)")
-        .execute()
+    doc = drive_folder_index.find_child(
+        service,
+        group_drive_folder_id,
+        retro_file_name,
+        "application/vnd.google-apps.document",
     )
-    docs = results.get("files", [])
-    if not docs:
+    if not doc:
         raise Exception(
             f"Retro file '{retro_file_name}' not found in group folder '{group}'."
         )
-    doc = docs[0]
 
     # Get the tabs, and ensure we have a 'Main' and 'Members' tab
     document = get_document_from_document_id(service, doc["id"])
@@ -383,15 +486,48 @@ def update_retro_file_google_doc(
     if "Main" not in existing_titles:
         raise Exception(f"Retro file '{retro_file_name}' does not have a 'Main' tab.")
 
-    rename_tabs_for_each_member(service, doc, group, members)
-    search_and_replace_group_and_member_names(service, doc["id"], group, members)
+    customize_retro_file_google_doc(
+        service, doc["id"], group, members, get_member_tab_ids(document)
+    )
 
 
-def search_and_replace_group_and_member_names(
-    service, document_id, group_name, members
+def customize_retro_file_google_doc(
+    service, document_id, group_name, members, member_tab_ids
 ):
+    """
+    Rename the member tabs and fill in the group and member names in a copy of
+    the retro template with a single batchUpdate, without fetching the copy.
+    `member_tab_ids` comes from get_member_tab_ids on the template.
+    """
+    requests = rename_member_tabs_requests(
+        member_tab_ids, members
+    ) + search_and_replace_requests(group_name, members)
+
+    docs_service = google_services.get_service_like(service, "docs", "v1")
+    rate_limits.execute(
+        docs_service.documents().batchUpdate(
+            documentId=document_id, body={"requests": requests}
+        ),
+        "docs",
+    )
+
 
-    substitutions = {
+def retro_file_hash(template, group_name, members):
+    # Hash of the template revision and everything customize_retro_file_google_doc
+    # puts into a copy of it, for artifact_stamps
+    return artifact_stamps.content_hash(
+        {
+            "artifact": "retro_doc",
+            "template": template["id"],
+            "revision": artifact_stamps.template_revision(template),
+            "tabs": [member["student_name"] for member in members],
+            "substitutions": retro_substitutions(group_name, members),
+        }
+    )
+
+
+def retro_substitutions(group_name, members):
+    return {
         "%TEAM%": group_name,
         "%MEMBERS%": ", ".join([member["student_name"] for member in members]),
         "%MEMBER1%": members[0]["student_name"] if len(members) > 0 else "",
@@ -402,15 +538,29 @@ def search_and_replace_group_and_member_names(
         "%MEMBER6%": members[5]["student_name"] if len(members) > 5 else "",
     }
 
+
+def search_and_replace_requests(group_name, members):
+    substitutions = retro_substitutions(group_name, members)
+
     requests = []
 
     for key, value in substitutions.items():
         requests.append(search_and_replace_in_doc_request(key, value))
+    return requests
 
-    docs_service = build("docs", "v1", credentials=service._http.credentials)
-    docs_service.documents().batchUpdate(
-        documentId=document_id, body={"requests": requests}
-    ).execute()
+
+def search_and_replace_group_and_member_names(
+    service, document_id, group_name, members
+):
+    requests = search_and_replace_requests(group_name, members)
+
+    docs_service = google_services.get_service_like(service, "docs", "v1")
+    rate_limits.execute(
+        docs_service.documents().batchUpdate(
+            documentId=document_id, body={"requests": requests}
+        ),
+        "docs",
+    )
 
 
 def search_and_replace_in_doc_request(search_text, replace_text):
@@ -425,17 +575,110 @@ def search_and_replace_in_doc_request(search_text, replace_text):
         }
     }
 
+def find_existing_files(service, file_name, folder_id):
+    return drive_folder_index.find_children(service, folder_id, file_name)
+
+
 def delete_existing_files(service, file_name, folder_id):
-    query = f"name='{file_name}' and '{folder_id}' in parents"
-    results = (
-        service.files()
-        .list(q=query, spaces="drive", fields="files(id, name)")
-        .execute()
-    )
-    files = results.get("files", [])
+    files = find_existing_files(service, file_name, folder_id)
     for file in files:
         print(f"Deleting existing file '{file['name']}' with ID {file['id']} in folder {folder_id}...")
-        service.files().delete(fileId=file["id"]).execute()
+        rate_limits.execute(service.files().delete(fileId=file["id"]), "drive")
+        drive_folder_index.remove_file(file["id"])
+
+
+def provision_group(
+    service,
+    group,
+    members,
+    parent_folder_id,
+    template,
+    retroFileName="Retro1",
+    journal=None,
+    member_tab_ids=None,
+):
+    """
+    Run every provisioning step for one group, in order:
+    folder create, share, members sheet, delete old retro and copy retro, update retro.
+    A members sheet or retro file whose artifact_stamps stamp matches the
+    current members and template revision is kept as is.
+
+    The folder create and share steps are recorded in `journal` (see
+    run_journal) and skipped without any API calls when already done with the
+    same members.  The members sheet and retro file are not journaled: their
+    stamps, read from the folder listing, say whether they are up to date.
+    `member_tab_ids` is get_member_tab_ids() of the template document.
+
+    Returns the ID of the group's folder; raises an exception if any step fails.
+    """
+
+    def make_folder():
+        print(f"Creating folder for group: {group}...")
+        return create_folder(service, group, parent_folder_id)
+
+    group_drive_folder_id = run_journal.run_step(journal, group, "folder", make_folder)
+
+    def share():
+        # Give each member write access to the group folder
+        emails = [student["email"] for student in members]
+        results, errors = share_folder_with_members(
+            service, group_drive_folder_id, emails
+        )
+        if errors:
+            raise Exception(
+                f"Failed to share folder for group {group} with {list(errors)}"
+            )
+
+    share_hash = artifact_stamps.content_hash(
+        sorted(student["email"].lower() for student in members)
+    )
+    run_journal.run_step(journal, group, "share", share, share_hash)
+
+    create_or_update_member_file_google_sheet(
+        service, group_drive_folder_id, group, members
+    )
+
+    new_name = f"{retroFileName}-{group}"
+    retro_hash = retro_file_hash(template, group, members)
+
+    def replace_retro():
+        # Delete the old retro file and copy the template in a single batch.
+        # A retro without a stamp (made before stamping, or copied by a run
+        # that stopped before customizing it) is replaced like a stale one.
+        existing_files = find_existing_files(service, new_name, group_drive_folder_id)
+        for file in existing_files:
+            if artifact_stamps.is_fresh(file, retro_hash):
+                print(f"  {group}: '{new_name}' is up to date, keeping it.")
+                return file
+        batch_requests = {}
+        for file in existing_files:
+            print(
+                f"Deleting existing file '{file['name']}' with ID {file['id']} in folder {group_drive_folder_id}..."
+            )
+            batch_requests[f"delete {group} {file['id']}"] = (
+                drive_batch_functions.delete_file_request(service, file["id"])
+            )
+        batch_requests[f"copy {group}"] = drive_batch_functions.copy_file_request(
+            service, template["id"], new_name, group_drive_folder_id
+        )
+        results, errors = drive_batch_functions.execute_batch(service, batch_requests)
+        for key in results:
+            if key.startswith("delete "):
+                drive_folder_index.remove_file(key.split(" ")[-1])
+        if errors:
+            raise Exception(f"Failed to copy retro file for group {group}: {errors}")
+        drive_folder_index.add_file(group_drive_folder_id, results[f"copy {group}"])
+        return results[f"copy {group}"]
+
+    retro_copy = replace_retro()
+
+    if not artifact_stamps.is_fresh(retro_copy, retro_hash):
+        customize_retro_file_google_doc(
+            service, retro_copy["id"], group, members, member_tab_ids or {}
+        )
+        # Stamp only once customized, so a half made copy is never taken as fresh
+        stamp_file(service, retro_copy["id"], retro_hash)
+    return group_drive_folder_id
 
 
 def make_group_folders_with_retro(
@@ -445,8 +688,19 @@ def make_group_folders_with_retro(
     filter=None,
     GROUP_CATEGORY_ID=None,
     retroFileName="Retro1",
-    
+    concurrency=PROVISIONING_CONCURRENCY,
+    run_id=None,
 ):
+    """
+    Provision a folder, members sheet and retro file for every group.
+
+    Progress is recorded in run_journal under `run_id` (by default the projects
+    folder and retro file names), so rerunning after a crash resumes where the
+    previous run stopped.  An ordinary rerun after the roster or template
+    changed shares the folder with new members and updates their sheet and
+    retro file (see provision_group).  Pass a new `run_id` to provision
+    everything again.
+    """
 
     # Step 1: Create the parent Projects folder
     parent_folder_id = create_folder(service, PROJECTS_FOLDER_NAME)
@@ -456,7 +710,8 @@ def make_group_folders_with_retro(
         f"Located retro file template: id: {template['id']}, name: {template['name']}"
     )
 
-    # Step 1a: Get the template document and extract existing tab names for later comparison
+    # Step 1a: Get the template document once, and find the IDs of its
+    # Member tabs; every copy keeps the same tab IDs
 
     template_document = get_document_from_document_id(service, template["id"])
 
@@ -464,57 +719,70 @@ def make_group_folders_with_retro(
     existing_titles = get_all_tab_titles(existing_tabs)
     print(f"Existing tab names in Template: {existing_titles}")
 
-    # Step 2: Create group folders and assign permissions
-    group_folders = {}
+    if "Main" not in existing_titles:
+        raise Exception(f"Retro template '{retroFileName}' does not have a 'Main' tab.")
+    member_tab_ids = get_member_tab_ids(template_document)
+
+    if run_id is None:
+        run_id = f"{PROJECTS_FOLDER_NAME}/{retroFileName}"
+    journal = run_journal.open_journal(run_id, GROUP_CATEGORY_ID)
+
+    # Step 2: Provision the groups in parallel, up to `concurrency` at a time.
+    # The steps for a single group still run in order within one worker.
+    # googleapiclient services are not thread safe, so google_services
+    # gives each worker thread its own Drive service with the same credentials
+    def provision_group_in_worker(group):
+        return provision_group(
+            google_services.get_service_like(service, "drive", "v3"),
+            group,
+            group_dict[group]["members"],
+            parent_folder_id,
+            template,
+            retroFileName,
+            journal,
+            member_tab_ids,
+        )
 
     print(f"Filter: {filter}")
     groups = list(group_dict.keys())
     groups.sort(key=folder_name_sort_key)
-    for group in groups:
-        value = group_dict[group]
-
-        if group == "":
-            print(f"Skipping group {group} as it has no name.")
-            names = [member["student_name"] for member in value["members"]]
-            print(f"This group has the following members: {names}")
-            continue
-
-        if filter and group not in filter:
-            print(f"Skipping group {group} as it is not in the filter list.")
+    futures = {}
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for group in groups:
+            value = group_dict[group]
+
+            if group == "":
+                print(f"Skipping group {group} as it has no name.")
+                names = [member["student_name"] for member in value["members"]]
+                print(f"This group has the following members: {names}")
+                continue
+
+            if filter and group not in filter:
+                print(f"Skipping group {group} as it is not in the filter list.")
+                continue
+
+            futures[group] = executor.submit(provision_group_in_worker, group)
+
+    # Step 3: Collect the results, so one group's failure does not stop the others
+    failures = {}
+    for group, future in futures.items():
+        try:
+            group_drive_folder_id = future.result()
+        except Exception as e:
+            failures[group] = e
             continue
-
-        print(f"Creating folder for group: {group}...")
-
-        group_drive_folder_id = create_folder(service, group, parent_folder_id)
         group_dict[group][
             "folder_url"
         ] = f"https://drive.google.com/drive/folders/{group_drive_folder_id}"
         group_dict[group]["group_drive_folder_id"] = group_drive_folder_id
 
-        # Give this user write access to the group folder
-        for student in value["members"]:
-            email = student["email"]
-            share_folder(service, group_drive_folder_id, email)
-
-        create_or_update_member_file_google_sheet(
-            service, group_drive_folder_id, group, value["members"]
-        )
-
-        new_name = f"{retroFileName}-{group}"
-
-        delete_existing_files(service, new_name, group_drive_folder_id)
-
-        copy_file(
-            service, template["id"], new_name, group_drive_folder_id
-        )
-
-        update_retro_file_google_doc(
-            service,
-            group_drive_folder_id,
-            group,
-            value["members"],
-            retro_file_name=f"{retroFileName}-{group}",
-        )
+    print("*" * 40)
+    print(f"Provisioned {len(futures) - len(failures)} of {len(futures)} groups.")
+    for group in futures:
+        if group in failures:
+            print(f"  FAILED: {group}: {failures[group]}")
+        else:
+            print(f"  OK: {group}")
 
     # Output the group dictionary to a CSV file
     output_file = f"group_folders_{GROUP_CATEGORY_ID}.csv"
@@ -588,30 +856,16 @@ def find_folder_id(service, name, parent_id=None):
 
 def find_folder(service, name, parent_id=None):
     """Find a folder by name and optionally parent folder ID."""
-    query = f"name='{name}' and mimeType='application/vnd.google-apps.folder'"
     if parent_id:
-        query += f" and '{parent_id}' in parents"
-    results = (
-        service.files()
-        .list(q=query, spaces="drive", fields="files(id, name)")
-        .execute()
-    )
-    folders = results.get("files", [])
-    return folders[0] if folders else None
+        return drive_folder_index.find_child(
+            service, parent_id, name, drive_folder_index.FOLDER_MIME_TYPE
+        )
+    return drive_folder_index.find_top_level_folder(service, name)
 
 
 def list_files_in_folder(service, folder_id):
     """List files and folders in a folder."""
-    results = (
-        service.files()
-        .list(
-            q=f"'{folder_id}' in parents and trashed = false",
-            spaces="drive",
-            fields="files(id, name, mimeType, createdTime, modifiedTime)",
-        )
-        .execute()
-    )
-    return results.get("files", [])
+    return drive_folder_index.list_children(service, folder_id)
 
 
 def copy_file_if_not_exists(service, file_id, new_name, parent_id):
@@ -628,8 +882,12 @@ def copy_file_if_not_exists(service, file_id, new_name, parent_id):
 
 def copy_file(service, file_id, new_name, parent_id):
     """Copy a file into a folder."""
-    copied_file = {"name": new_name, "parents": [parent_id]}
-    return service.files().copy(fileId=file_id, body=copied_file).execute()
+    copy = rate_limits.execute(
+        drive_batch_functions.copy_file_request(service, file_id, new_name, parent_id),
+        "drive",
+    )
+    drive_folder_index.add_file(parent_id, copy)
+    return copy
 
 
 def get_notebook_file_id_and_name(service, PROJECTS_FOLDER_NAME):
@@ -639,11 +897,14 @@ def get_notebook_file_id_and_name(service, PROJECTS_FOLDER_NAME):
         raise Exception("Projects folder not found.")
 
     # Step 2: Find the 'Initial Contents' folder inside Projects
-    initial_id = find_folder_id(service, "Initial Contents", parent_id=projects_id)
-    if not initial_id:
+    initial_folder = drive_folder_index.resolve_path(
+        service, [PROJECTS_FOLDER_NAME, INITIAL_PROJECTS_FOLDER_NAME]
+    )
+    if not initial_folder:
         raise Exception(
             f"'Initial Contents' folder not found inside {PROJECTS_FOLDER_NAME}."
         )
+    initial_id = initial_folder["id"]
 
     # Step 3: Get the list of all files inside the 'Initial Contents' folder
     files = list_files_in_folder(service, initial_id)
@@ -707,55 +968,126 @@ def folder_name_sort_key(folder_name):
         return float("inf")  # If it doesn't match, sort it to the end
 
 
-def move_all_files_in_folder(service, src=None, dest=None):
-    if not src or not dest:
-        raise Exception("Source and destination folder IDs must be provided.")
-    print(f"Moving files from {src['name']} to {dest['name']}...")
+def move_all_files_requests(service, src, dest):
+    # Batch requests (see drive_batch_functions) moving every file in src to dest
     iterate_files = list_files_in_folder(service, src["id"])
+    requests = {}
     for file in iterate_files:
         file_id = file["id"]
         file_name = file["name"]
         print(f"Moving {file_name} from {src['name']} to {dest['name']}...")
-        service.files().update(
-            fileId=file_id,
-            addParents=dest["id"],
-            removeParents=src["id"],
-            fields="id, parents",
-        ).execute()
-        print(f"Moved {file_name} to {dest['name']}.")
+        requests[f"move {file_name} {file_id}"] = (
+            drive_batch_functions.move_file_request(
+                service, file_id, src["id"], dest["id"]
+            )
+        )
+    return requests
+
+
+def move_all_files_in_folder(service, src=None, dest=None):
+    if not src or not dest:
+        raise Exception("Source and destination folder IDs must be provided.")
+    print(f"Moving files from {src['name']} to {dest['name']}...")
+    requests = move_all_files_requests(service, src, dest)
+    results, errors = drive_batch_functions.execute_batch(service, requests)
+    for key in results:
+        drive_folder_index.move_file(key.split(" ")[-1], src["id"], dest["id"])
+    print(f"Moved {len(results)} files to {dest['name']}.")
 
 
 def folder_id_to_name(service, folder_id):
     """Get the name of a folder by its ID."""
     try:
-        file = service.files().get(fileId=folder_id, fields="name").execute()
+        file = rate_limits.execute(
+            service.files().get(fileId=folder_id, fields="name"), "drive"
+        )
         return file.get("name")
     except HttpError as error:
         print(f"An error occurred: {error}")
         return None
 
 
-def fix_filenames(service, name, folder_name, files):
-    files_for_name = [file for file in files if name in file["name"]]
-    print(f"  Found {len(files_for_name)} files for {name} in {folder_name}.")
-    suffix_num = 0
-    for file in files_for_name:
-        file_id = file["id"]
-        file_name = file["name"]
+def filename_tokens(text):
+    # Normalize a member name or filename into casefolded word parts, so
+    # "Chris_Gaucho", "chris gaucho" and "Chris-Gaucho" all match.  \W is
+    # Unicode aware, so names like "José_Núñez" and "李明" keep their letters
+    return tuple(part for part in re.split(r"[\W_]+", text.casefold()) if part)
 
-        if file_name.endswith("UNTOUCHED.ipynb") or file_name.endswith(f"{name}.ipynb"):
-            new_file_name = file_name.replace("_UNTOUCHED", "")
 
-            new_file_name = new_file_name.replace(".ipynb", f"_{suffix_num}.ipynb")
-            print(f"  Renaming {file_name} to {new_file_name} in {folder_name}.")
-            rename_file = (
-                service.files()
-                .update(fileId=file_id, body={"name": new_file_name})
-                .execute()
+def build_filename_index(files, names):
+    """
+    Map each of `names` to the files (in the order of `files`) whose names
+    contain it as a run of whole tokens.  Each filename is split into tokens
+    once and its runs of tokens looked up in a dict of the names, instead of
+    searching every filename for every name.
+    """
+    # A name with no letters or digits has no tokens and can match nothing
+    name_keys = {
+        filename_tokens(name): name for name in names if filename_tokens(name)
+    }
+    longest = max((len(key) for key in name_keys), default=0)
+    index = {name: [] for name in names}
+    for file in files:
+        tokens = filename_tokens(file["name"].removesuffix(".ipynb"))
+        matched = set()
+        for start in range(len(tokens)):
+            for length in range(1, longest + 1):
+                name = name_keys.get(tokens[start : start + length])
+                if name is not None and name not in matched:
+                    matched.add(name)
+                    index[name].append(file)
+    return index
+
+
+def plan_filename_fixes(files, names):
+    """
+    Decide, in one pass over the filename index, which files to rename:
+    for each name, the files ending in UNTOUCHED.ipynb or {name}.ipynb get
+    _UNTOUCHED dropped and their position among that name's files appended.
+    Returns {file_id: new_file_name}.
+    """
+    index = build_filename_index(files, names)
+    renames = {}
+    for name in names:
+        for suffix_num, file in enumerate(index[name]):
+            file_name = file["name"]
+            if file["id"] in renames:
+                continue
+            if file_name.endswith("UNTOUCHED.ipynb") or file_name.endswith(f"{name}.ipynb"):
+                new_file_name = file_name.replace("_UNTOUCHED", "")
+                new_file_name = new_file_name.replace(".ipynb", f"_{suffix_num}.ipynb")
+                renames[file["id"]] = new_file_name
+    return renames
+
+
+def fix_filenames_requests(service, names, folder_name, files):
+    # Batch requests (see drive_batch_functions) for every rename planned for
+    # `names` in one folder
+    renames = plan_filename_fixes(files, names)
+    requests = {}
+    for file in files:
+        if file["id"] in renames:
+            print(f"  Renaming {file['name']} to {renames[file['id']]} in {folder_name}.")
+            requests[f"rename {file['name']} {file['id']}"] = (
+                drive_batch_functions.rename_file_request(
+                    service, file["id"], renames[file["id"]]
+                )
             )
-            print(f"  Renamed {file_name} to {new_file_name} in {folder_name}.")
+    return requests
+
+
+def send_renames(service, requests, where):
+    if requests:
+        results, errors = drive_batch_functions.execute_batch(service, requests)
+        for key, file in results.items():
+            drive_folder_index.rename_file(file["id"], file["name"])
+        print(f"  Renamed {len(results)} files in {where}.")
+
 
-        suffix_num += 1
+def fix_filenames(service, name, folder_name, files):
+    send_renames(
+        service, fix_filenames_requests(service, [name], folder_name, files), folder_name
+    )
 
 
 def scan_group_folders(
@@ -769,49 +1101,65 @@ def scan_group_folders(
         raise Exception("Projects folder not found.")
 
     # Step 2: Iterate over all folders in the Projects folder
-    results = (
-        service.files()
-        .list(
-            q=f"'{projects_folder['id']}' in parents and mimeType='application/vnd.google-apps.folder'",
-            spaces="drive",
-            fields="files(id, name)",
-        )
-        .execute()
-    )
-    folders = results.get("files", [])
+    folders = [
+        file
+        for file in list_files_in_folder(service, projects_folder["id"])
+        if file["mimeType"] == drive_folder_index.FOLDER_MIME_TYPE
+        and file["name"] not in [INITIAL_PROJECTS_FOLDER_NAME, "data"]
+        and not file["name"].startswith("Midterm")
+    ]
 
     # Sort the folders by name
     folders.sort(key=folder_sort_key)
 
+    # Step 3: Snapshot the two level tree (group folders, and the OLD and
+    # EXTRA folders inside them) with a few chunked multi-folder listings,
+    # instead of several lookups per group folder
+    drive_folder_index.list_children_of_many(
+        service, [folder["id"] for folder in folders]
+    )
+    subfolders = {}
+    for folder in folders:
+        for subfolder_name in ["OLD", "EXTRA"]:
+            subfolder = find_folder(service, subfolder_name, parent_id=folder["id"])
+            if subfolder:
+                subfolders[(folder["id"], subfolder_name)] = subfolder
+    drive_folder_index.list_children_of_many(
+        service, [subfolder["id"] for subfolder in subfolders.values()]
+    )
+
+    # Step 4: Move everything out of the OLD and EXTRA folders in one batch
+    move_requests = {}
+    moves = {}
+    for folder in folders:
+        for subfolder_name in ["OLD", "EXTRA"]:
+            subfolder = subfolders.get((folder["id"], subfolder_name))
+            if subfolder:
+                print(f"  Found {subfolder_name} folder in {folder['name']}:")
+                requests = move_all_files_requests(service, subfolder, folder)
+                move_requests.update(requests)
+                for key in requests:
+                    moves[key] = (subfolder["id"], folder["id"])
+    if move_requests:
+        results, errors = drive_batch_functions.execute_batch(service, move_requests)
+        for key in results:
+            src_id, dest_id = moves[key]
+            drive_folder_index.move_file(key.split(" ")[-1], src_id, dest_id)
+        print(f"Moved {len(results)} files out of OLD and EXTRA folders.")
+
+    # Step 5: Plan the filename fixes in each folder, from the snapshot
+    rename_requests = {}
     for folder in folders:
         print("*" * 40)
         print(f"Folder: {folder['name']} (ID: {folder['id']})")
 
-        if folder["name"] in [INITIAL_PROJECTS_FOLDER_NAME, "data"]:
-            continue
-
-        if folder["name"].startswith("Midterm"):
-            continue
-
-        # Look for a folder inside each folder called "OLD"
-
-        old_folder = find_folder(service, "OLD", parent_id=folder["id"])
-        extra_folder = find_folder(service, "EXTRA", parent_id=folder["id"])
-
         folder_id = folder["id"]
         folder_name = folder["name"]
 
-        if old_folder:
-            print(f"  Found OLD folder:")
-            move_all_files_in_folder(service, src=old_folder, dest=folder)
-        if extra_folder:
-            print(f"  Found EXTRA folder:")
-            move_all_files_in_folder(service, src=extra_folder, dest=folder)
-
         # Get new list of all files in the folder
         files = list_files_in_folder(service, folder_id)
         # Sort the files by name and then by created time
-        files.sort(key=lambda x: (x["name"], x["createdTime"]))
+        files.sort(key=lambda x: (x["name"], x.get("createdTime", "")))
 
         print(f"  Found {len(files)} files in {folder_name}.")
 
@@ -828,39 +1176,88 @@ def scan_group_folders(
         ]
         print(f"  Group members: {group_member_names_with_underscores}")
 
-        for member_name in group_member_names_with_underscores:
-            fix_filenames(service, member_name, folder_name, files)
-
-        fix_filenames(service, "FINAL", folder_name, files)
-
-        # # Step 3: List all files in the folder
-        # files = list_files_in_folder(service, folder_id)
-        # for file in files:
-        #     file_id = file['id']
-        #     file_name = file['name']
-        #     if file_name.endswith('UNTOUCHED.ipynb'):
-        #         # If the file name ends with _UNTOUCHED.ipynb, move it into the OLD folder
-        #         # Move the file into the OLD folder
-        #         service.files().update(
-        #             fileId=file_id,
-        #             addParents=old_folder_id,
-        #             removeParents=folder_id,
-        #             fields='id, parents'
-        #         ).execute()
-        #         print(f"  Moved {file_name} to EXTRA folder in {folder_name}.")
-
-        #     else:
-        #          # Get history of the file
-
-        #         file_editors = list_editors( drive_activity_service, file_id, file_name)
-        #         pprint(file_editors)
-        #         if (len(file_editors) == 1) and file_editors[0]['display_name'] == 'Phill Conrad':
-        #             # rename file by appending _UNTOUCHED before .ipynb
-        #             new_file_name = file_name.replace('.ipynb', '_UNTOUCHED.ipynb')
-        #             service.files().update(fileId=file_id, body={'name': new_file_name}).execute()
-        #             print(f"  Renamed {file_name} to {new_file_name} in {folder_name}.")
-
-        # print("\n")
+        rename_requests.update(
+            fix_filenames_requests(
+                service,
+                group_member_names_with_underscores + ["FINAL"],
+                folder_name,
+                files,
+            )
+        )
+
+    # Step 6: Send the renames for every folder as one batch
+    send_renames(service, rename_requests, PROJECTS_FOLDER_NAME)
+
+    # Untouched notebooks (still identical to the one in Initial Contents)
+    # are found by find_untouched_notebooks, from checksums rather than from
+    # Drive Activity, and marked with mark_untouched_notebooks.
+
+
+UNTOUCHED_CHECK_FIELDS = "id, name, parents, md5Checksum, size, version"
+
+
+def find_untouched_notebooks(service, PROJECTS_FOLDER_NAME):
+    """
+    Classify every notebook in the project's group folders as untouched (its
+    md5Checksum and size still match the notebook in Initial Contents) or
+    edited, using one chunked multi-folder files.list pass over the project.
+    A copy's version starts over from the template's, so it is reported
+    alongside but not compared.
+
+    Returns {"untouched": [file], "edited": [file]}.
+    """
+    notebook_file_id, notebook_file_name = get_notebook_file_id_and_name(
+        service, PROJECTS_FOLDER_NAME
+    )
+    template = rate_limits.execute(
+        service.files().get(fileId=notebook_file_id, fields=UNTOUCHED_CHECK_FIELDS),
+        "drive",
+    )
+
+    projects_folder = find_folder(service, PROJECTS_FOLDER_NAME)
+    if not projects_folder:
+        raise Exception("Projects folder not found.")
+    folder_ids = [
+        file["id"]
+        for file in list_files_in_folder(service, projects_folder["id"])
+        if file["mimeType"] == drive_folder_index.FOLDER_MIME_TYPE
+        and file["name"] not in [INITIAL_PROJECTS_FOLDER_NAME, "data"]
+    ]
+
+    classified = {"untouched": [], "edited": []}
+    for file in drive_listing.iter_children_of_many(
+        service, folder_ids, fields=UNTOUCHED_CHECK_FIELDS
+    ):
+        if not file["name"].endswith(".ipynb"):
+            continue
+        if file.get("md5Checksum") == template.get("md5Checksum") and file.get(
+            "size"
+        ) == template.get("size"):
+            classified["untouched"].append(file)
+        else:
+            classified["edited"].append(file)
+
+    print(
+        f"Compared {len(classified['untouched']) + len(classified['edited'])} notebooks with {notebook_file_name}: "
+        f"{len(classified['untouched'])} untouched, {len(classified['edited'])} edited."
+    )
+    return classified
+
+
+def mark_untouched_notebooks(service, classified):
+    # Rename each untouched notebook by appending _UNTOUCHED before .ipynb,
+    # as one batch
+    requests = {}
+    for file in classified["untouched"]:
+        file_name = file["name"]
+        if file_name.endswith("UNTOUCHED.ipynb"):
+            continue
+        new_file_name = file_name.replace(".ipynb", "_UNTOUCHED.ipynb")
+        print(f"  Renaming {file_name} to {new_file_name}.")
+        requests[f"rename {file_name} {file['id']}"] = (
+            drive_batch_functions.rename_file_request(service, file["id"], new_file_name)
+        )
+    send_renames(service, requests, "untouched notebooks")
 
 
 def authorize_drive_activity_api():
@@ -875,10 +1272,14 @@ def authorize_drive_activity_api():
             creds = flow.run_local_server(port=0)
         with open("token.json", "w") as token:
             token.write(creds.to_json())
-    return build("driveactivity", "v2", credentials=creds)
+    return google_services.get_service("driveactivity", "v2", creds)
 
 
 def get_credentials():
+    # Load the credentials once and reuse them for the rest of the run
+    if getattr(get_credentials, "_cache", None) is not None:
+        return get_credentials._cache
+
     creds = None
     if os.path.exists("token.pkl"):
         with open("token.pkl", "rb") as token:
@@ -888,70 +1289,45 @@ def get_credentials():
         creds = flow.run_local_server(port=0)
         with open("token.pkl", "wb") as token:
             pickle.dump(creds, token)
+    get_credentials._cache = creds
     return creds
 
 
 def resolve_person_name(people_service, person_resource_name):
-    try:
-        person = (
-            people_service.people()
-            .get(resourceName=person_resource_name, personFields="names,emailAddresses")
-            .execute()
-        )
-
-        names = person.get("names", [])
-        emails = person.get("emailAddresses", [])
-
-        display_name = names[0]["displayName"] if names else "Unknown"
-        email = emails[0]["value"] if emails else "No email"
-        return {
-            "display_name": display_name,
-            "email": email,
-            "person_resource_name": person_resource_name,
-        }
-
-    except Exception as e:
-        return {
-            "display_name": None,
-            "email": None,
-            "person_resource_name": person_resource_name,
-            "error": str(e),
-        }
+    return drive_activity.resolve_people(people_service, [person_resource_name])[
+        person_resource_name
+    ]
 
 
 def list_editors(activity_service, file_id, file_name):
-    creds = get_credentials()
     print(f"Getting history for file: {file_name} ({file_id})")
-    time.sleep(SLEEP_TIME)
-    # Create the correct services
-    people_service = build("people", "v1", credentials=creds)
-
-    response = (
-        activity_service.activity()
-        .query(
-            body={
-                "itemName": f"items/{file_id}",
-                "filter": "detail.action_detail_case:EDIT",
-            }
-        )
-        .execute()
-    )
-
-    if response.get("error"):
-        print(f"Error: {response['error']}")
-        sys.exit(1)
+    people_service = google_services.get_service_like(activity_service, "people", "v1")
 
     editors = set()
-    for activity in response.get("activities", []):
+    for activity in drive_activity.iter_edit_activities(
+        activity_service, file_id=file_id
+    ):
         for actor in activity.get("actors", []):
             known_user = actor.get("user", {}).get("knownUser", {})
-            if known_user:
-                editors.add(known_user.get("personName"))
+            if known_user.get("personName"):
+                editors.add(known_user["personName"])
 
-    names = list(
-        map(lambda person_id: resolve_person_name(people_service, person_id), editors)
+    people = drive_activity.resolve_people(people_service, editors)
+    return [people[person_id] for person_id in editors]
+
+
+def list_editors_in_project(activity_service, PROJECTS_FOLDER_NAME):
+    """
+    Return {file_id: [editor]} for every file in the project, from one paginated
+    Drive Activity query over the whole projects folder (see drive_activity).
+    """
+    projects_id = find_folder_id(
+        google_services.get_service_like(activity_service, "drive", "v3"),
+        PROJECTS_FOLDER_NAME,
     )
-    return names
+    if not projects_id:
+        raise Exception("Projects folder not found.")
+    return drive_activity.list_editors_by_file(activity_service, projects_id)
 
 
 def add_google_drive_folder_links(
@@ -961,6 +1337,8 @@ def add_google_drive_folder_links(
     drive_activity_service,
     PROJECTS_FOLDER_NAME,
     addFeedback=False,
+    limits=None,
+    assume_yes=None,
 ):
 
     # Step 0: locate the canvas assignment
@@ -977,8 +1355,9 @@ def add_google_drive_folder_links(
     if not projects_id:
         raise Exception("Projects folder not found.")
 
-    # Step 2: Iterate over groups
+    # Step 2: Iterate over groups, collecting one comment per student
 
+    comments_by_student_id = {}
     for group_name, group_info in group_dict.items():
         if group_name == "":
             print(f"Skipping group {group_name} as it has no name.")
@@ -994,13 +1373,14 @@ def add_google_drive_folder_links(
             <p><a href="{url}">{url}></p>
             """
 
-            if addFeedback:
-                canvas_roster_functions.add_feedback_to_submission_unless_duplicate(
-                    assignment_id, student_id, text
-                )
-                print(
-                    f"Added feedback for {student['student_name']} in group {group_name} with ID {student_id}."
-                )
+            comments_by_student_id[student_id] = text
+
+    # Step 3: Add every new comment after a single approval (see batch_mode)
+
+    if addFeedback:
+        canvas_roster_functions.add_feedback_to_submissions_unless_duplicate(
+            assignment_id, comments_by_student_id, limits, assume_yes
+        )
 
 
 if __name__ == "__main__":
@@ -0,0 +1,202 @@
+"""
+Shared throttling and retry for every API call made by these scripts.
+
+Each API gets a token bucket sized to its published per-user quota, so calls
+go out as fast as the quota allows instead of after a fixed sleep.  Calls that
+come back with 429 or 403 rateLimitExceeded / userRateLimitExceeded are
+retried with exponential backoff and jitter, honoring Retry-After.  A 5xx
+error or a dropped connection is retried only if the request can safely be
+repeated: a write that may have completed before the error (creating a space,
+posting a Canvas comment, copying a file) is not sent again, so it never
+happens twice.  Canvas calls also slow down when X-Rate-Limit-Remaining runs
+low.
+
+Use execute(request, api) for googleapiclient requests and
+send(session, method, url, api, ...) for calls made with requests.
+"""
+
+import random
+import threading
+import time
+
+import requests
+from googleapiclient.errors import HttpError
+
+# api -> (requests per second, burst size), from each API's per-user quota
+RATE_LIMITS = {
+    "drive": (12000 / 60, 100),  # 12,000 queries per minute per user
+    "docs": (60 / 60, 10),  # 60 write requests per minute per user
+    "sheets": (60 / 60, 10),  # 60 requests per minute per user
+    "chat": (600 / 60, 10),  # 600 requests per minute per user
+    "chat_space": (1, 1),  # 1 write per second per space
+    "people": (90 / 60, 10),  # 90 read requests per minute per user
+    "driveactivity": (600 / 60, 10),  # 600 queries per minute per user
+    "canvas": (10, 10),  # Canvas throttles on X-Rate-Limit-Remaining instead
+}
+
+MAX_RETRIES = 6
+MAX_BACKOFF = 64  # seconds
+RETRYABLE_STATUS_CODES = [429, 500, 502, 503, 504]
+# Methods that can be repeated without changing the result.  PATCH is
+# included because every PATCH these scripts send (Drive files.update,
+# permissions.update) sets fields to fixed values.
+IDEMPOTENT_METHODS = ["GET", "HEAD", "OPTIONS", "PUT", "PATCH", "DELETE"]
+RETRYABLE_REASONS = ["rateLimitExceeded", "userRateLimitExceeded", "Rate Limit Exceeded"]
+
+# Canvas starts with a bucket of 700; pause when fewer than this remain
+CANVAS_LOW_REMAINING = 100
+CANVAS_LOW_REMAINING_PAUSE = 2  # seconds
+
+# (api, key) -> [tokens, time of last refill]
+_buckets = {}
+_lock = threading.Lock()
+
+
+def acquire(api, key=None):
+    """
+    Wait until a call to `api` is allowed.  `key` selects a separate bucket
+    with the same rate, e.g. one per Chat space.
+    """
+    rate, burst = RATE_LIMITS[api]
+    while True:
+        with _lock:
+            now = time.monotonic()
+            tokens, last = _buckets.get((api, key), (burst, now))
+            tokens = min(burst, tokens + (now - last) * rate)
+            if tokens >= 1:
+                _buckets[(api, key)] = (tokens - 1, now)
+                return
+            _buckets[(api, key)] = (tokens, now)
+            wait = (1 - tokens) / rate
+        time.sleep(wait)
+
+
+def backoff_delay(attempt):
+    """
+    Exponential backoff with full jitter: a random delay up to 2**attempt
+    seconds (at most MAX_BACKOFF), plus half a second so a retry never goes
+    out immediately.
+    """
+    return random.uniform(0, min(2**attempt, MAX_BACKOFF)) + 0.5
+
+
+def retry_after(headers):
+    """Seconds to wait according to a Retry-After header, or None."""
+    value = headers.get("Retry-After") or headers.get("retry-after")
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def is_idempotent(method):
+    return method.upper() in IDEMPOTENT_METHODS
+
+
+def is_retryable(status, content, idempotent=True):
+    """
+    True if a response with `status` should be retried: always when throttled,
+    and on a server error only if the request is `idempotent`.
+    """
+    if status == 429:
+        return True
+    if status in RETRYABLE_STATUS_CODES:
+        return idempotent
+    if status == 403:
+        if isinstance(content, bytes):
+            content = content.decode("utf-8", "replace")
+        return any(reason in (content or "") for reason in RETRYABLE_REASONS)
+    return False
+
+
+def is_retryable_error(exception, idempotent=True):
+    """
+    True if `exception` is a googleapiclient rate limit error, or a server
+    error and the request is `idempotent`.
+    """
+    if not isinstance(exception, HttpError):
+        return False
+    return is_retryable(exception.resp.status, exception.content, idempotent)
+
+
+def is_idempotent_request(request):
+    """True if the googleapiclient `request` can safely be sent again."""
+    return is_idempotent(getattr(request, "method", "POST"))
+
+
+def execute(request, api="drive", key=None, idempotent=None):
+    """
+    Execute a googleapiclient request under `api`'s rate limit, retrying on
+    throttling.  `idempotent` defaults to what the request's HTTP method says;
+    pass True for a write that is safe to repeat.
+    """
+    if idempotent is None:
+        idempotent = is_idempotent_request(request)
+    for attempt in range(MAX_RETRIES + 1):
+        acquire(api, key)
+        try:
+            return request.execute()
+        except HttpError as error:
+            if attempt == MAX_RETRIES or not is_retryable_error(error, idempotent):
+                raise
+            delay = retry_after(error.resp) or backoff_delay(attempt)
+            print(
+                f"{api} request failed with {error.resp.status}; retrying in {delay:.1f} seconds..."
+            )
+        except (ConnectionError, TimeoutError) as error:
+            # The request may have reached the server, so only repeat it if safe
+            if attempt == MAX_RETRIES or not idempotent:
+                raise
+            delay = backoff_delay(attempt)
+            print(f"{api} request failed with {error}; retrying in {delay:.1f} seconds...")
+        time.sleep(delay)
+
+
+def send(session, method, url, api, key=None, idempotent=None, **kwargs):
+    """
+    Send an HTTP request with `session` (a requests.Session, or the requests
+    module itself) under `api`'s rate limit, retrying on throttling.
+    `idempotent` defaults to what `method` says; pass True for a write that is
+    safe to repeat (e.g. one with a requestId) and False for one that is not.
+    Returns the final response; callers still check its status code.
+    """
+    if idempotent is None:
+        idempotent = is_idempotent(method)
+    for attempt in range(MAX_RETRIES + 1):
+        acquire(api, key)
+        try:
+            response = session.request(method, url, **kwargs)
+        except requests.exceptions.ConnectionError as error:
+            # A request that never connected was never sent, so it is always safe to repeat
+            if attempt == MAX_RETRIES or not (
+                idempotent or isinstance(error, requests.exceptions.ConnectTimeout)
+            ):
+                raise
+            delay = backoff_delay(attempt)
+            print(f"{api} request failed with {error}; retrying in {delay:.1f} seconds...")
+            time.sleep(delay)
+            continue
+
+        if api == "canvas":
+            pause_if_canvas_quota_low(response)
+
+        if attempt == MAX_RETRIES or not is_retryable(
+            response.status_code, response.text, idempotent
+        ):
+            return response
+        delay = retry_after(response.headers) or backoff_delay(attempt)
+        print(
+            f"{api} request failed with {response.status_code}; retrying in {delay:.1f} seconds..."
+        )
+        time.sleep(delay)
+
+
+def pause_if_canvas_quota_low(response):
+    remaining = response.headers.get("X-Rate-Limit-Remaining")
+    try:
+        remaining = float(remaining)
+    except (TypeError, ValueError):
+        return
+    if remaining < CANVAS_LOW_REMAINING:
+        print(f"Canvas rate limit remaining is {remaining:.0f}; pausing...")
+        time.sleep(CANVAS_LOW_REMAINING_PAUSE)
@@ -0,0 +1,92 @@
+"""
+Append-only JSONL journal of completed provisioning steps.
+
+Each line records one completed step, keyed by run id, group set, group and
+step name, along with the step's result (e.g. the ID of a folder it created).
+When a run is restarted with the same run id and group set, run_step() returns
+the recorded result of a completed step without calling it again, so the run
+picks up at the first step that did not finish.
+
+A step whose work depends on inputs that can change between runs (e.g. the
+group's members) is recorded with a hash of those inputs, and is skipped only
+while that hash matches the latest one recorded for the step, so it runs
+again whenever its inputs change (including back to what they once were).
+
+To start over from scratch, use a new run id (or delete the journal file).
+"""
+
+import threading
+from datetime import datetime, timezone
+
+import json_files
+
+JOURNAL_FILE = "run_journal.jsonl"
+
+_lock = threading.Lock()
+
+
+def open_journal(run_id, group_set, path=JOURNAL_FILE):
+    """Load the steps already completed for (`run_id`, `group_set`) from `path`."""
+    completed = {}
+    # (group, step) -> inputs_hash of the latest completion
+    hashes = {}
+    for entry in json_files.read_jsonl(path):
+        if entry["run_id"] == run_id and entry["group_set"] == str(group_set):
+            completed[(entry["group"], entry["step"])] = entry.get("result")
+            hashes[(entry["group"], entry["step"])] = entry.get("inputs_hash")
+    print(
+        f"Journal {path}: run '{run_id}', group set {group_set}: {len(completed)} steps already done."
+    )
+    return {
+        "path": path,
+        "run_id": run_id,
+        "group_set": str(group_set),
+        "completed": completed,
+        "hashes": hashes,
+    }
+
+
+def step_done(journal, group, step, inputs_hash=None):
+    """
+    True if `step` of `group` has been done, and (if `inputs_hash` is given)
+    its latest completion was with the same inputs.
+    """
+    if journal is None or (group, step) not in journal["completed"]:
+        return False
+    return inputs_hash is None or journal["hashes"].get((group, step)) == inputs_hash
+
+
+def step_result(journal, group, step):
+    return journal["completed"].get((group, step))
+
+
+def record_step(journal, group, step, result=None, inputs_hash=None):
+    entry = {
+        "run_id": journal["run_id"],
+        "group_set": journal["group_set"],
+        "group": group,
+        "step": step,
+        "result": result,
+        "inputs_hash": inputs_hash,
+        "time": datetime.now(timezone.utc).isoformat(),
+    }
+    with _lock:
+        json_files.append_jsonl(journal["path"], entry)
+        journal["completed"][(group, step)] = result
+        journal["hashes"][(group, step)] = inputs_hash
+
+
+def run_step(journal, group, step, func, inputs_hash=None):
+    """
+    Call `func()` and record its (JSON serializable) result as `step` of `group`,
+    unless the journal says that step already finished (with the same
+    `inputs_hash`, if given), in which case return the recorded result
+    instead.  With journal=None this just calls `func()`.
+    """
+    if step_done(journal, group, step, inputs_hash):
+        print(f"  {group}: '{step}' already done, skipping.")
+        return step_result(journal, group, step)
+    result = func()
+    if journal is not None:
+        record_step(journal, group, step, result, inputs_hash)
+    return result
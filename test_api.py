@@ -1,6 +1,8 @@
 import requests
 import json
 
+import rate_limits
+
 
 # Read credentials from credentials.json
 with open('token_chat.json') as f:
@@ -14,5 +16,5 @@ headers = {
     'Authorization': f'Bearer {access_token}'
 }
 
-response = requests.get(url, headers=headers)
+response = rate_limits.send(requests, "GET", url, "chat", headers=headers)
 print(response.status_code, response.text)